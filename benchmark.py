@@ -0,0 +1,253 @@
+#!/usr/bin/python3
+import argparse
+from collections import OrderedDict
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import make_synthetic_csdl
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+GENERATOR = os.path.join(SCRIPT_DIR, "redfish_to_grpc.py")
+
+
+def git_revision():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"],
+                cwd=SCRIPT_DIR,
+                stderr=subprocess.DEVNULL,
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def count_schema_files(schema_dir):
+    count = 0
+    for root, dirs, files in os.walk(schema_dir):
+        count += len([x for x in files if x.endswith(".xml")])
+    return count
+
+
+def snapshot_tree(directory):
+    # Every file under directory, with enough to tell if it was touched
+    snapshot = {}
+    for root, dirs, files in os.walk(directory):
+        for filename in files:
+            filepath = os.path.join(root, filename)
+            stat = os.stat(filepath)
+            snapshot[os.path.relpath(filepath, directory)] = (
+                stat.st_size,
+                stat.st_mtime_ns,
+            )
+    return snapshot
+
+
+def check_tree_unchanged(directory, snapshot):
+    current = snapshot_tree(directory)
+    if current != snapshot:
+        changed = sorted(
+            relpath
+            for relpath in set(current) | set(snapshot)
+            if current.get(relpath) != snapshot.get(relpath)
+        )
+        raise Exception(
+            "The generator wrote to {} instead of its own output directory: "
+            "{}".format(directory, ", ".join(changed[:10]))
+        )
+
+
+def run_generator(schema_dir, generator_args):
+    # Every run starts cold, in its own process and output directory, so runs
+    # can't warm each other's caches
+    with tempfile.TemporaryDirectory() as workdir:
+        stats_path = os.path.join(workdir, "phases.json")
+        args = [
+            sys.executable,
+            GENERATOR,
+            "--schema-dir",
+            schema_dir,
+            "--output-dir",
+            os.path.join(workdir, "grpc"),
+            "--cpp-output-dir",
+            os.path.join(workdir, "include"),
+            "--no-cache",
+            "--offline",
+            "--phase-stats",
+            stats_path,
+        ] + generator_args
+        start = time.perf_counter()
+        subprocess.check_call(args, stdout=subprocess.DEVNULL)
+        wall = time.perf_counter() - start
+        with open(stats_path) as filehandle:
+            phases = json.load(filehandle)["phases"]
+    return wall, phases
+
+
+def print_summary(runs):
+    corpora = []
+    for run in runs:
+        if run["corpus"] not in corpora:
+            corpora.append(run["corpus"])
+    for corpus in corpora:
+        corpus_runs = [x for x in runs if x["corpus"] == corpus]
+        # Time per file makes super-linear phases stand out across corpora
+        wall = statistics.median([x["wall_s"] for x in corpus_runs])
+        files = corpus_runs[0]["files"]
+        print(
+            "{} ({} files, {} runs): {:.2f}s, {:.2f}ms per file".format(
+                corpus, files, len(corpus_runs), wall, 1000 * wall / max(files, 1)
+            )
+        )
+        phases = [x["phase"] for x in corpus_runs[0]["phases"]]
+        for phase in phases:
+            samples = [
+                stats
+                for run in corpus_runs
+                for stats in run["phases"]
+                if stats["phase"] == phase
+            ]
+            print(
+                "    {:<16} wall {:8.3f}s  cpu {:8.3f}s  peak rss {:8d} KB".format(
+                    phase,
+                    statistics.median([x["wall_s"] for x in samples]),
+                    statistics.median(
+                        [x["cpu_s"] + x["children_cpu_s"] for x in samples]
+                    ),
+                    max([x["peak_rss_kb"] for x in samples]),
+                )
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time every phase of redfish_to_grpc.py on one or more "
+        "schema corpora"
+    )
+    parser.add_argument(
+        "--corpus",
+        action="append",
+        default=[],
+        help="directory of CSDL schemas to benchmark; may be given more than "
+        "once, and defaults to the bundled csdl directory unless --synthetic "
+        "is given",
+    )
+    parser.add_argument(
+        "--synthetic",
+        type=int,
+        action="append",
+        default=[],
+        metavar="NAMESPACES",
+        help="also benchmark a synthetic corpus with this many namespaces, "
+        "shaped by the options below; may be given more than once to see how "
+        "each phase scales",
+    )
+    make_synthetic_csdl.add_shape_arguments(parser)
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="number of times to run the generator on each corpus",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="jobs to pass to the generator",
+    )
+    parser.add_argument(
+        "--start-method",
+        help="start method to pass to the generator",
+    )
+    parser.add_argument(
+        "--no-protoc",
+        action="store_true",
+        help="leave protoc out of the benchmark",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=os.path.join(SCRIPT_DIR, "benchmark_results.json"),
+        help="JSON file to write the results to",
+    )
+    args = parser.parse_args()
+
+    corpora = args.corpus
+    if len(corpora) == 0 and len(args.synthetic) == 0:
+        corpora = [os.path.join(SCRIPT_DIR, "csdl")]
+
+    generator_args = []
+    if args.jobs is not None:
+        generator_args += ["--jobs", str(args.jobs)]
+    if args.start_method is not None:
+        generator_args += ["--start-method", args.start_method]
+    if args.no_protoc:
+        generator_args.append("--no-protoc")
+
+    # Runs write to temporary directories only; if anything lands in the
+    # checked-in output or the repo's parse cache, the timings are of the
+    # wrong work, so that stops the benchmark
+    repo_dirs = [
+        os.path.join(SCRIPT_DIR, "grpc"),
+        os.path.join(SCRIPT_DIR, ".parse_cache"),
+    ]
+    repo_snapshots = [snapshot_tree(directory) for directory in repo_dirs]
+
+    results = {
+        "revision": git_revision(),
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "generator_args": generator_args,
+        "runs": [],
+    }
+    with tempfile.TemporaryDirectory() as synthetic_dir:
+        # corpus name to its schema directory
+        schema_dirs = OrderedDict()
+        for corpus in corpora:
+            schema_dirs[corpus] = os.path.realpath(corpus)
+        for namespaces in args.synthetic:
+            shape = make_synthetic_csdl.shape_from_args(args, namespaces)
+            corpus = "synthetic-{}".format(namespaces)
+            schema_dirs[corpus] = os.path.join(synthetic_dir, corpus)
+            make_synthetic_csdl.write_corpus(schema_dirs[corpus], shape)
+            results.setdefault("synthetic_shapes", {})[corpus] = vars(shape)
+
+        for corpus, schema_dir in schema_dirs.items():
+            files = count_schema_files(schema_dir)
+            for index in range(args.repeat):
+                print(
+                    "Running {} ({} files), {}/{}".format(
+                        corpus, files, index + 1, args.repeat
+                    )
+                )
+                wall, phases = run_generator(schema_dir, generator_args)
+                for directory, snapshot in zip(repo_dirs, repo_snapshots):
+                    check_tree_unchanged(directory, snapshot)
+                results["runs"].append(
+                    {
+                        "corpus": corpus,
+                        "files": files,
+                        "run": index,
+                        "wall_s": wall,
+                        "phases": phases,
+                    }
+                )
+
+    with open(args.output, "w") as filehandle:
+        json.dump(results, filehandle, indent=1)
+    print_summary(results["runs"])
+    print("Wrote {}".format(args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+#!/usr/bin/python3
+import os
+import argparse
+import shutil
+import xml.etree.ElementTree as ET
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+REDFISH_SCHEMA_DIR = os.path.join(SCRIPT_DIR, "csdl")
+
+EDMX = "http://docs.oasis-open.org/odata/ns/edmx"
+EDM = "http://docs.oasis-open.org/odata/ns/edm"
+SCHEMA_URI = "http://redfish.example.com/schemas/v1/"
+CORE_VOCABULARY = "Org.OData.Core.V1.xml"
+CORE_VOCABULARY_URI = (
+    "http://docs.oasis-open.org/odata/odata/v4.0/errata03/csd01/complete/"
+    "vocabularies/" + CORE_VOCABULARY
+)
+
+# Scalar types that properties cycle through, along with the enum, complex,
+# typedef and collection types each namespace defines
+scalar_types = ["Edm.String", "Edm.Int64", "Edm.Boolean", "Edm.Decimal"]
+
+
+class CorpusShape:
+    def __init__(
+        self,
+        namespaces=10,
+        versions=5,
+        properties=8,
+        fan_out=2,
+        inheritance_depth=1,
+        navigation_cycles=1,
+    ):
+        # Number of schema files, not counting ServiceRoot
+        self.namespaces = namespaces
+        # Versioned namespaces in each file, each inheriting from the last
+        self.versions = versions
+        # Properties each version of a type adds
+        self.properties = properties
+        # Child namespaces each namespace references and navigates to
+        self.fan_out = fan_out
+        # Abstract types below each versioned chain
+        self.inheritance_depth = inheritance_depth
+        # Namespaces with a navigation property back to the first one.  Every
+        # other one, starting with the last namespace, contains its target, so
+        # the generator has to break the cycle it nests.
+        self.navigation_cycles = navigation_cycles
+
+
+def get_namespace_name(index):
+    return "Synthetic{}".format(index)
+
+
+def get_filename(namespace):
+    return namespace + "_v1.xml"
+
+
+def get_version(index):
+    return "v1_{}_0".format(index)
+
+
+def get_children(shape, index):
+    # The namespaces form a tree with fan_out children per node, reached by
+    # contained navigation properties, so every type is reachable from
+    # ServiceRoot
+    first = index * shape.fan_out + 1
+    return [x for x in range(first, first + shape.fan_out) if x < shape.namespaces]
+
+
+def has_cycle(shape, index):
+    return index != 0 and index >= shape.namespaces - shape.navigation_cycles
+
+
+def has_nested_cycle(shape, index):
+    return has_cycle(shape, index) and (shape.namespaces - 1 - index) % 2 == 0
+
+
+def add_reference(edmx, uri, namespaces, alias=None):
+    reference = ET.SubElement(edmx, "{%s}Reference" % EDMX, {"Uri": uri})
+    for namespace in namespaces:
+        include = ET.SubElement(
+            reference, "{%s}Include" % EDMX, {"Namespace": namespace}
+        )
+        if alias is not None:
+            include.set("Alias", alias)
+
+
+def add_annotation(element, term, **attributes):
+    attributes["Term"] = term
+    ET.SubElement(element, "{%s}Annotation" % EDM, attributes)
+
+
+def add_property(entity, name, type_name, read_only):
+    property_element = ET.SubElement(
+        entity, "{%s}Property" % EDM, {"Name": name, "Type": type_name}
+    )
+    permission = "OData.Permission/Read" if read_only else "OData.Permission/ReadWrite"
+    add_annotation(property_element, "OData.Permissions", EnumMember=permission)
+    add_annotation(
+        property_element,
+        "OData.Description",
+        String="Synthetic property {}.".format(name),
+    )
+
+
+def add_navigation_property(entity, name, type_name, contains_target):
+    attributes = {"Name": name, "Type": type_name}
+    if contains_target:
+        attributes["ContainsTarget"] = "true"
+    navigation = ET.SubElement(entity, "{%s}NavigationProperty" % EDM, attributes)
+    add_annotation(navigation, "OData.Permissions", EnumMember="OData.Permission/Read")
+    add_annotation(navigation, "OData.AutoExpandReferences")
+
+
+def new_document(references):
+    edmx = ET.Element("{%s}Edmx" % EDMX, {"Version": "4.0"})
+    add_reference(edmx, CORE_VOCABULARY_URI, ["Org.OData.Core.V1"], "OData")
+    for namespace in references:
+        add_reference(edmx, SCHEMA_URI + get_filename(namespace), [namespace])
+    data_services = ET.SubElement(edmx, "{%s}DataServices" % EDMX)
+    return edmx, data_services
+
+
+def add_schema(data_services, namespace):
+    return ET.SubElement(data_services, "{%s}Schema" % EDM, {"Namespace": namespace})
+
+
+def make_namespace_document(shape, index):
+    namespace = get_namespace_name(index)
+    children = get_children(shape, index)
+    references = [get_namespace_name(x) for x in children]
+    if has_cycle(shape, index):
+        references.append(get_namespace_name(0))
+    edmx, data_services = new_document(references)
+
+    # Abstract types, each inheriting from the one before, with the type the
+    # versions implement at the bottom
+    schema = add_schema(data_services, namespace)
+    basetype = None
+    levels = ["Base{}".format(x) for x in range(shape.inheritance_depth)]
+    for name in levels + [namespace]:
+        attributes = {"Name": name, "Abstract": "true"}
+        if basetype is not None:
+            attributes["BaseType"] = basetype
+        ET.SubElement(schema, "{%s}EntityType" % EDM, attributes)
+        basetype = "{}.{}".format(namespace, name)
+
+    for version_index in range(shape.versions):
+        version_namespace = "{}.{}".format(namespace, get_version(version_index))
+        schema = add_schema(data_services, version_namespace)
+        entity = ET.SubElement(
+            schema,
+            "{%s}EntityType" % EDM,
+            {"Name": namespace, "BaseType": basetype},
+        )
+        basetype = "{}.{}".format(version_namespace, namespace)
+
+        first_version = "{}.{}".format(namespace, get_version(0))
+        local_types = scalar_types + [
+            first_version + ".State",
+            first_version + ".Status",
+            first_version + ".Identifier",
+            "Collection(Edm.String)",
+        ]
+        for property_index in range(shape.properties):
+            add_property(
+                entity,
+                "V{}Property{}".format(version_index, property_index),
+                local_types[property_index % len(local_types)],
+                property_index % 2 == 0,
+            )
+
+        if version_index != 0:
+            continue
+
+        for child in children:
+            child_namespace = get_namespace_name(child)
+            child_type = "{0}.{0}".format(child_namespace)
+            if child % 2 == 0:
+                child_type = "Collection({})".format(child_type)
+            add_navigation_property(entity, child_namespace, child_type, True)
+            add_property(
+                entity,
+                child_namespace + "Status",
+                "{}.{}.Status".format(child_namespace, get_version(0)),
+                True,
+            )
+        if has_cycle(shape, index):
+            add_navigation_property(
+                entity,
+                "Root",
+                "{0}.{0}".format(get_namespace_name(0)),
+                has_nested_cycle(shape, index),
+            )
+
+        enum_type = ET.SubElement(schema, "{%s}EnumType" % EDM, {"Name": "State"})
+        for member in ["Enabled", "Disabled", "Absent"]:
+            ET.SubElement(enum_type, "{%s}Member" % EDM, {"Name": member})
+        ET.SubElement(schema, "{%s}ComplexType" % EDM, {"Name": "Status"})
+        ET.SubElement(
+            schema,
+            "{%s}TypeDefinition" % EDM,
+            {"Name": "Identifier", "UnderlyingType": "Edm.String"},
+        )
+    return edmx
+
+
+def make_service_root_document(shape):
+    root_namespace = get_namespace_name(0)
+    edmx, data_services = new_document([root_namespace])
+    schema = add_schema(data_services, "ServiceRoot")
+    ET.SubElement(
+        schema, "{%s}EntityType" % EDM, {"Name": "ServiceRoot", "Abstract": "true"}
+    )
+    schema = add_schema(data_services, "ServiceRoot.v1_0_0")
+    entity = ET.SubElement(
+        schema,
+        "{%s}EntityType" % EDM,
+        {"Name": "ServiceRoot", "BaseType": "ServiceRoot.ServiceRoot"},
+    )
+    add_property(entity, "RedfishVersion", "Edm.String", True)
+    add_navigation_property(
+        entity, root_namespace, "{0}.{0}".format(root_namespace), True
+    )
+    return edmx
+
+
+def write_document(edmx, filepath):
+    tree = ET.ElementTree(edmx)
+    ET.indent(tree)
+    tree.write(filepath, encoding="UTF-8", xml_declaration=True)
+
+
+def write_corpus(directory, shape):
+    ET.register_namespace("edmx", EDMX)
+    ET.register_namespace("", EDM)
+    os.makedirs(directory, exist_ok=True)
+
+    # The annotations reference the core vocabulary, so bring it along rather
+    # than leave the generator to download it
+    vocabulary = os.path.join(REDFISH_SCHEMA_DIR, CORE_VOCABULARY)
+    if os.path.exists(vocabulary):
+        shutil.copy(vocabulary, os.path.join(directory, CORE_VOCABULARY))
+
+    write_document(
+        make_service_root_document(shape),
+        os.path.join(directory, get_filename("ServiceRoot")),
+    )
+    for index in range(shape.namespaces):
+        write_document(
+            make_namespace_document(shape, index),
+            os.path.join(directory, get_filename(get_namespace_name(index))),
+        )
+
+
+def get_positive_count(value):
+    count = int(value)
+    if count < 1:
+        raise argparse.ArgumentTypeError("{} isn't at least 1".format(value))
+    return count
+
+
+def add_shape_arguments(parser):
+    defaults = CorpusShape()
+    parser.add_argument(
+        "--namespaces",
+        type=int,
+        default=defaults.namespaces,
+        help="number of schema files, not counting ServiceRoot",
+    )
+    parser.add_argument(
+        "--versions",
+        type=get_positive_count,
+        default=defaults.versions,
+        help="versioned namespaces per file",
+    )
+    parser.add_argument(
+        "--properties",
+        type=int,
+        default=defaults.properties,
+        help="properties each version of a type adds",
+    )
+    parser.add_argument(
+        "--fan-out",
+        type=int,
+        default=defaults.fan_out,
+        help="schema files each file references and navigates to",
+    )
+    parser.add_argument(
+        "--inheritance-depth",
+        type=int,
+        default=defaults.inheritance_depth,
+        help="abstract base types below each versioned type",
+    )
+    parser.add_argument(
+        "--navigation-cycles",
+        type=int,
+        default=defaults.navigation_cycles,
+        help="files with a navigation property back to the first one; every "
+        "other one contains its target, nesting a cycle",
+    )
+
+
+def shape_from_args(args, namespaces=None):
+    return CorpusShape(
+        args.namespaces if namespaces is None else namespaces,
+        args.versions,
+        args.properties,
+        args.fan_out,
+        args.inheritance_depth,
+        args.navigation_cycles,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write a synthetic CSDL schema tree for scaling tests"
+    )
+    parser.add_argument("directory", help="directory to write the schemas to")
+    add_shape_arguments(parser)
+    args = parser.parse_args()
+
+    shape = shape_from_args(args)
+    write_corpus(args.directory, shape)
+    print("Wrote {} schema files to {}".format(shape.namespaces + 1, args.directory))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,75 @@
 #!/usr/bin/python3
 import os
+import argparse
+import json
 import xml.etree.ElementTree as ET
 import pprint
+import sys
 import requests
+from requests.adapters import HTTPAdapter
 from urllib.parse import urlparse
 from enum import Enum
-from multiprocessing import Pool, cpu_count
+from collections import OrderedDict, Counter, deque
+import multiprocessing
+from multiprocessing import cpu_count, get_context
+import hashlib
+import pickle
 import shutil
 import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import resource
+import signal
+import threading
+import cProfile
+import pstats
+import tracemalloc
+import textwrap
+import mmap
+import xml.parsers.expat
+
+try:
+    import lxml.etree
+except ImportError:
+    lxml = None
 
 multithread = True
 
+# Only regenerate the outputs whose schema inputs changed since the last run,
+# rather than clearing the grpc tree
+incremental = False
+
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
 REDFISH_SCHEMA_DIR = os.path.join(SCRIPT_DIR, "csdl")
 GRPC_DIR = os.path.join(SCRIPT_DIR, "grpc")
 PROTO_OUT_DIR = os.path.join(GRPC_DIR, "proto_out")
-
-
-# The current mechanisms of generation have problems with circular imports.
-# Will likely need a way in the future to set an explicit max depth
-circular_imports = [
-    "SubProcessors",
-    "AllocatedPools",
-    "CapacitySources",
-    "StorageGroups",
-    "Steps",
-    "MetricReportDefinition",
-    "SubTasks",
-    "DataProtectionLinesOfService",
+CPP_OUT_DIR = os.path.join(SCRIPT_DIR, "..", "include")
+
+# Parsed schema records and resolved type graphs are kept here between runs,
+# keyed by the hash of their inputs and of this script.  None disables the
+# cache.
+PARSE_CACHE_DIR = os.path.join(SCRIPT_DIR, ".parse_cache")
+
+# Carry on when a referenced schema or type can't be found, leaving out the
+# properties that need it, rather than failing the run
+allow_missing_schemas = False
+
+# How the parse and emission pools start their workers, one of
+# multiprocessing's start methods, or None for the platform default.  Under
+# spawn and forkserver a worker starts from this module's defaults, not what
+# main() set, so anything it needs is handed over in its initializer.
+start_method = None
+
+# Counts of what the run did, reported by get_run_summary
+counters = Counter()
+reported_counters = [
+    "files_parsed",
+    "records_cache_hits",
+    "xml_cache_hits",
+    "xml_cache_misses",
+    "find_element_in_scope_calls",
+    "find_element_in_scope_failures",
 ]
 
 
@@ -85,7 +127,22 @@ def basetype_to_grpc(basetype):
         print("Can't find type for {}")
 
 
+# The schema model classes use __slots__ and interned names, as there is one
+# instance per type and property in every schema that gets loaded
+
+
 class EntityType:
+    __slots__ = (
+        "name",
+        "properties",
+        "basetype",
+        "basetype_flat",
+        "namespace",
+        "abstract",
+        "from_file",
+        "uris",
+    )
+
     def __init__(self, name, basetype, basetype_flat, namespace, abstract, from_file):
         self.name = name
         self.properties = []
@@ -94,9 +151,13 @@ class EntityType:
         self.namespace = namespace
         self.abstract = abstract
         self.from_file = from_file
+        # URI templates from the Redfish.Uris annotation
+        self.uris = []
 
 
 class Enum:
+    __slots__ = ("name", "values", "namespace", "from_file")
+
     def __init__(self, name, values, namespace, from_file):
         self.name = name
         self.values = values
@@ -105,6 +166,8 @@ class Enum:
 
 
 class Complex:
+    __slots__ = ("name", "namespace", "from_file")
+
     def __init__(self, name, namespace, from_file):
         self.name = name
         self.namespace = namespace
@@ -112,6 +175,8 @@ class Complex:
 
 
 class TypeDef:
+    __slots__ = ("name", "basetype", "namespace", "from_file")
+
     def __init__(self, name, basetype, namespace, from_file):
         self.name = name
         self.basetype = basetype
@@ -120,6 +185,8 @@ class TypeDef:
 
 
 class Collection:
+    __slots__ = ("name", "contained_type", "from_file")
+
     def __init__(self, name, contained_type, from_file):
         self.name = name
         self.contained_type = contained_type
@@ -131,43 +198,129 @@ class PropertyPermissions(Enum):
     READ_WRITE = 1
 
 
-class Property:
-    def __init__(
-        self, name, thistype, permissions, description, long_description, from_file
-    ):
+class PropertyDocumentation:
+    # Documentation is never emitted, so it is read from the schema on demand
+    # rather than kept for every property.  owner is the qualified name of the
+    # type that declares the property.
+    __slots__ = ()
+
+    @property
+    def description(self):
+        return get_property_documentation(self.from_file, self.owner, self.name)[0]
+
+    @property
+    def long_description(self):
+        return get_property_documentation(self.from_file, self.owner, self.name)[1]
+
+
+class LazyPropertyType:
+    # The type of a property is only looked up the first time an emitter reads
+    # it.  Until then type_name and references say where to find it.
+    __slots__ = ()
+
+    @property
+    def type(self):
+        if self.type_name is not None:
+            self._type = find_element_in_scope(
+                self.type_name, self.references, self.from_file
+            )
+            if self._type is None:
+                if not allow_missing_schemas:
+                    raise Exception(
+                        "Unable to find type {} for property {} in {}; pass "
+                        "--allow-missing-schemas to leave it out".format(
+                            self.type_name, self.name, self.from_file
+                        )
+                    )
+                print("Unable to find type for {}".format(self.type_name))
+            self.type_name = None
+            self.references = None
+        return self._type
+
+    @type.setter
+    def type(self, value):
+        self._type = value
+        self.type_name = None
+        self.references = None
+
+
+class Property(PropertyDocumentation, LazyPropertyType):
+    __slots__ = (
+        "name",
+        "_type",
+        "type_name",
+        "references",
+        "permissions",
+        "from_file",
+        "owner",
+        "by_reference",
+    )
+
+    def __init__(self, name, type_name, references, permissions, from_file, owner):
         self.name = name
-        self.type = thistype
+        self._type = None
+        self.type_name = type_name
+        self.references = references
         self.permissions = permissions
-        self.description = description
-        self.long_description = long_description
         self.from_file = from_file
+        self.owner = owner
+        # Set by break_type_cycles when nesting the value would form a cycle
+        self.by_reference = False
+
+
+class NavigationProperty(PropertyDocumentation, LazyPropertyType):
+    __slots__ = (
+        "name",
+        "_type",
+        "type_name",
+        "references",
+        "permissions",
+        "auto_expand",
+        "expand_references",
+        "from_file",
+        "contains_target",
+        "owner",
+        "by_reference",
+    )
 
-
-class NavigationProperty:
     def __init__(
         self,
         name,
-        thistype,
+        type_name,
+        references,
         permissions,
         auto_expand,
         expand_references,
-        description,
-        long_description,
         from_file,
         contains_target,
+        owner,
     ):
         self.name = name
-        self.type = thistype
+        self._type = None
+        self.type_name = type_name
+        self.references = references
         self.permissions = permissions
         self.auto_expand = auto_expand
         self.expand_references = expand_references
-        self.description = description
-        self.long_description = long_description
         self.from_file = from_file
         self.contains_target = contains_target
+        self.owner = owner
+        # Set by break_type_cycles when nesting the value would form a cycle
+        self.by_reference = False
+
+
+def is_inlined(property_obj):
+    # Whether the value of a property is nested in the message that has it,
+    # rather than sent as a NavigationReference to it
+    if property_obj.by_reference:
+        return False
+    if isinstance(property_obj, NavigationProperty):
+        return property_obj.contains_target or property_obj.auto_expand
+    return True
 
 
 def find_element_in_scope(element_name, references, this_file):
+    counters["find_element_in_scope_calls"] += 1
     if element_name.startswith("Collection(") and element_name.endswith(")"):
         contained_element = find_element_in_scope(
             element_name[11:-1], references, this_file
@@ -178,17 +331,15 @@ def find_element_in_scope(element_name, references, this_file):
     if edmtype is not None:
         return edmtype
 
-    for reference_uri, namespaces in references:
-        uri = urlparse(reference_uri)
-
-        filepath = os.path.join(REDFISH_SCHEMA_DIR, os.path.basename(uri.path))
+    # Includes only list a subset of the namespaces a referenced file defines,
+    # so the whole file is searched rather than filtering on them
+    for reference_uri, _namespaces in references:
+        filepath = get_reference_filepath(reference_uri)
         if not os.path.exists(filepath):
-            print("File doesn't exist, downloading from {}".format(reference_uri))
-            r = requests.get(reference_uri)
-            r.raise_for_status()
-            open(filepath, "wb").write(r.content)
+            # prefetch_schemas has already tried to download it
+            continue
 
-        elements = parse_file(filepath, namespaces, element_name)
+        elements = parse_file(filepath, [], element_name)
 
         if len(elements) == 0:
             continue
@@ -203,8 +354,9 @@ def find_element_in_scope(element_name, references, this_file):
         return elements[0]
 
     # finish by searching the file we're in now
-    elements = parse_file(this_file, namespaces, element_name)
+    elements = parse_file(this_file, [], element_name)
     if len(elements) != 1:
+        counters["find_element_in_scope_failures"] += 1
         return None
     return elements[0]
 
@@ -212,250 +364,920 @@ def find_element_in_scope(element_name, references, this_file):
     return None
 
 
-xml_cache = {}
+def get_reference_filepath(reference_uri):
+    uri = urlparse(reference_uri)
+    return os.path.join(REDFISH_SCHEMA_DIR, os.path.basename(uri.path))
 
 
-def parse_file(filename, namespaces_to_check=[], element_name_filter=None):
+def fetch_schema(session, reference_uri, mirror, offline):
+    filepath = get_reference_filepath(reference_uri)
+    basename = os.path.basename(filepath)
+
+    sources = []
+    if mirror is not None:
+        if urlparse(mirror).scheme in ["http", "https"]:
+            sources.append(mirror.rstrip("/") + "/" + basename)
+        elif os.path.exists(os.path.join(mirror, basename)):
+            # Through a temporary file, as for downloads below
+            temp_filepath = filepath + ".tmp"
+            shutil.copyfile(os.path.join(mirror, basename), temp_filepath)
+            os.replace(temp_filepath, filepath)
+            return filepath, os.path.join(mirror, basename)
+    if not offline:
+        sources.append(reference_uri)
+
+    for source in sources:
+        try:
+            r = session.get(source, timeout=60)
+            r.raise_for_status()
+        except requests.RequestException as e:
+            print("Unable to fetch {}: {}".format(source, e))
+            continue
+        # Write to a temporary file first so that an interrupted download is
+        # never mistaken for a schema
+        temp_filepath = filepath + ".tmp"
+        with open(temp_filepath, "wb") as filehandle:
+            filehandle.write(r.content)
+        os.replace(temp_filepath, filepath)
+        return filepath, source
+    return filepath, None
+
+
+def prefetch_schemas(mirror=None, offline=False, jobs=8, allow_missing=False):
+    # Download every schema that is referenced but missing before resolution
+    # starts, following the references of the downloaded schemas in turn, so
+    # the resolver never has to wait on the network.  A schema that can't be
+    # found fails the run here, unless allow_missing is set, rather than
+    # leaving the resolver to fail on it much later.
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=jobs, pool_maxsize=jobs)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    pending = []
+    for root, dirs, files in os.walk(REDFISH_SCHEMA_DIR):
+        pending.extend(
+            [
+                os.path.join(root, filename)
+                for filename in files
+                if filename.endswith(".xml")
+            ]
+        )
+    pending.sort()
+
+    attempted = set()
+    unavailable = []
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while len(pending) != 0:
+            missing = []
+            for filepath in pending:
+                for reference_uri, _namespaces in index_file(filepath).references:
+                    reference_filepath = get_reference_filepath(reference_uri)
+                    if reference_filepath in attempted:
+                        continue
+                    attempted.add(reference_filepath)
+                    if not os.path.exists(reference_filepath):
+                        missing.append(reference_uri)
+
+            pending = []
+            results = executor.map(
+                lambda uri: fetch_schema(session, uri, mirror, offline), missing
+            )
+            for reference_uri, (filepath, source) in zip(missing, results):
+                if source is None:
+                    print("Unable to find schema for {}".format(reference_uri))
+                    unavailable.append(os.path.basename(filepath))
+                    continue
+                print("Fetched {} from {}".format(os.path.basename(filepath), source))
+                pending.append(filepath)
+    session.close()
+
+    if len(unavailable) != 0 and not allow_missing:
+        raise Exception(
+            "Unable to find referenced schemas {}; add them to {}, or pass "
+            "--allow-missing-schemas to generate without them".format(
+                ", ".join(sorted(unavailable)), REDFISH_SCHEMA_DIR
+            )
+        )
+
+
+# How CSDL files are read into records; one of xml_backends.  "iterparse"
+# streams the file, dropping the XML as it goes, "etree" parses whole trees
+# and keeps them in xml_cache, "lxml" walks an lxml tree with precompiled
+# XPath, and "expat" builds records straight from parser events over a memory
+# mapped file.  Every backend produces the same records.
+xml_backend = "iterparse"
+
+# Maximum number of whole trees to keep in xml_cache for the etree backend,
+# least recently used first out.  None keeps every tree for the life of the
+# process.
+xml_cache_size = 32
+
+xml_cache = OrderedDict()
+
+# Backends that read whole trees through xml_cache; the xml_cache counters are
+# only reported for these
+xml_cache_backends = ["etree"]
+
+# Schema element kinds that parse_file knows how to turn into types
+indexed_tags = [
+    "{http://docs.oasis-open.org/odata/ns/edm}EntityType",
+    "{http://docs.oasis-open.org/odata/ns/edm}EnumType",
+    "{http://docs.oasis-open.org/odata/ns/edm}ComplexType",
+    "{http://docs.oasis-open.org/odata/ns/edm}TypeDefinition",
+]
+
+
+class PropertyRecord:
+    __slots__ = (
+        "name",
+        "type_name",
+        "navigation",
+        "read_only",
+        "auto_expand",
+        "expand_references",
+        "contains_target",
+    )
+
+    def __init__(
+        self,
+        name,
+        type_name,
+        navigation,
+        read_only,
+        auto_expand,
+        expand_references,
+        contains_target,
+    ):
+        self.name = sys.intern(name)
+        self.type_name = sys.intern(type_name)
+        self.navigation = navigation
+        self.read_only = read_only
+        self.auto_expand = auto_expand
+        self.expand_references = expand_references
+        self.contains_target = contains_target
+
+
+def intern_optional(value):
+    if value is None:
+        return None
+    return sys.intern(value)
+
+
+class TypeRecord:
+    __slots__ = (
+        "tag",
+        "name",
+        "namespace",
+        "base_type",
+        "abstract",
+        "underlying_type",
+        "members",
+        "properties",
+        "uris",
+    )
+
+    def __init__(
+        self,
+        tag,
+        name,
+        namespace,
+        base_type=None,
+        abstract=False,
+        underlying_type=None,
+    ):
+        self.tag = sys.intern(tag)
+        self.name = intern_optional(name)
+        self.namespace = sys.intern(namespace)
+        self.base_type = intern_optional(base_type)
+        self.abstract = abstract
+        self.underlying_type = intern_optional(underlying_type)
+        self.members = []
+        self.properties = []
+        self.uris = []
+
+
+def get_property_annotations(property_element):
+    navigation = (
+        property_element.tag
+        == "{http://docs.oasis-open.org/odata/ns/edm}NavigationProperty"
+    )
+    for child in property_element:
+        if (
+            navigation
+            or child.tag == "{http://docs.oasis-open.org/odata/ns/edm}Annotation"
+        ):
+            yield child
+
+
+def property_record_from_element(property_element):
+    navigation = (
+        property_element.tag
+        == "{http://docs.oasis-open.org/odata/ns/edm}NavigationProperty"
+    )
+    record = PropertyRecord(
+        property_element.attrib["Name"],
+        property_element.attrib["Type"],
+        navigation,
+        False,
+        False,
+        False,
+        property_element.attrib.get("ContainsTarget", "false") == "true",
+    )
+    for child in get_property_annotations(property_element):
+        term = child.attrib.get("Term", "")
+        if term == "OData.AutoExpandReferences" and navigation:
+            record.expand_references = True
+        elif term == "OData.AutoExpand" and navigation:
+            record.auto_expand = True
+        elif term == "OData.Permissions":
+            perm = child.attrib.get("EnumMember", "")
+            if perm == "OData.Permission/Read":
+                record.read_only = True
+    return record
+
+
+def load_property_documentation(filename):
+    documentation = {}
+    namespace = None
+    type_name = None
+    for event, element in ET.iterparse(filename, events=("start", "end")):
+        if event == "start":
+            if element.tag == "{http://docs.oasis-open.org/odata/ns/edm}Schema":
+                namespace = element.attrib["Namespace"]
+            elif element.tag == "{http://docs.oasis-open.org/odata/ns/edm}EntityType":
+                type_name = element.attrib.get("Name", None)
+            continue
+
+        if element.tag in [
+            "{http://docs.oasis-open.org/odata/ns/edm}Property",
+            "{http://docs.oasis-open.org/odata/ns/edm}NavigationProperty",
+        ]:
+            if type_name is not None:
+                description = ""
+                long_description = ""
+                for child in get_property_annotations(element):
+                    term = child.attrib.get("Term", "")
+                    if term == "OData.Description":
+                        description = child.attrib.get("String", "")
+                    elif term == "OData.LongDescription":
+                        long_description = child.attrib.get("String", "")
+                key = (namespace + "." + type_name, element.attrib["Name"])
+                documentation[key] = (description, long_description)
+            element.clear()
+        elif element.tag == "{http://docs.oasis-open.org/odata/ns/edm}EntityType":
+            type_name = None
+            element.clear()
+    return documentation
+
+
+# filename to the documentation of every property it declares
+documentation_cache = OrderedDict()
+documentation_cache_size = 8
+
+
+def get_property_documentation(filename, owner, property_name):
+    documentation = documentation_cache.get(filename, None)
+    if documentation is None:
+        documentation = load_property_documentation(filename)
+        documentation_cache[filename] = documentation
+        while len(documentation_cache) > documentation_cache_size:
+            documentation_cache.popitem(last=False)
+    else:
+        documentation_cache.move_to_end(filename)
+    return documentation.get((owner, property_name), ("", ""))
+
+
+def get_uris_from_annotation(annotation):
+    for collection in annotation.findall(
+        "{http://docs.oasis-open.org/odata/ns/edm}Collection"
+    ):
+        for uri in collection.findall(
+            "{http://docs.oasis-open.org/odata/ns/edm}String"
+        ):
+            yield sys.intern((uri.text or "").strip())
+
+
+def type_record_from_element(namespace, schema_element):
+    record = TypeRecord(
+        schema_element.tag,
+        schema_element.attrib.get("Name", None),
+        namespace,
+        schema_element.attrib.get("BaseType", None),
+        schema_element.attrib.get("Abstract", "false") == "true",
+        schema_element.attrib.get("UnderlyingType", None),
+    )
+    if schema_element.tag == "{http://docs.oasis-open.org/odata/ns/edm}EntityType":
+        for property_element in schema_element:
+            if property_element.tag in [
+                "{http://docs.oasis-open.org/odata/ns/edm}Property",
+                "{http://docs.oasis-open.org/odata/ns/edm}NavigationProperty",
+            ]:
+                record.properties.append(property_record_from_element(property_element))
+            elif (
+                property_element.tag
+                == "{http://docs.oasis-open.org/odata/ns/edm}Annotation"
+                and property_element.attrib.get("Term", None) == "Redfish.Uris"
+            ):
+                record.uris.extend(get_uris_from_annotation(property_element))
+    elif schema_element.tag == "{http://docs.oasis-open.org/odata/ns/edm}EnumType":
+        for member in schema_element.findall(
+            "{http://docs.oasis-open.org/odata/ns/edm}Member"
+        ):
+            record.members.append(sys.intern(member.attrib["Name"]))
+    return record
 
+
+def reference_from_element(reference):
+    namespaces = []
+    for include in reference.findall(
+        "{http://docs.oasis-open.org/odata/ns/edmx}Include"
+    ):
+        ns = include.attrib["Namespace"]
+        alias = include.attrib.get("Alias", ns)
+        namespaces.append((ns, alias))
+    return (reference.attrib["Uri"], namespaces)
+
+
+class SchemaFile:
+    def __init__(self, filename):
+        self.filename = filename
+        # list of (uri, [(namespace, alias)])
+        self.references = []
+        # TypeRecord for every indexed element, in document order
+        self.records = []
+        # qualified, alias qualified, and bare names to a list of TypeRecord
+        self.symbols = {}
+
+    def add_symbol(self, key, record):
+        self.symbols.setdefault(key, []).append(record)
+
+    def add_record(self, record, alias=None):
+        self.records.append(record)
+        if record.name is None:
+            return
+        self.add_symbol(record.name, record)
+        self.add_symbol(record.namespace + "." + record.name, record)
+        if alias is not None and alias != record.namespace:
+            self.add_symbol(alias + "." + record.name, record)
+
+    def lookup(self, element_name, namespaces_to_check=[]):
+        matches = self.symbols.get(element_name, [])
+        if len(namespaces_to_check) == 0:
+            return matches
+        return [match for match in matches if match.namespace in namespaces_to_check]
+
+
+def load_xml_tree(filename):
     root = xml_cache.get(filename, None)
-    if root is None:
-        tree = ET.parse(filename)
-        root = tree.getroot()
-        xml_cache[filename] = root
+    if root is not None:
+        counters["xml_cache_hits"] += 1
+        xml_cache.move_to_end(filename)
+        return root
 
-    # list of references and namespaces
-    references = []
+    counters["xml_cache_misses"] += 1
+    tree = ET.parse(filename)
+    root = tree.getroot()
+    xml_cache[filename] = root
+    if xml_cache_size is not None:
+        while len(xml_cache) > xml_cache_size:
+            xml_cache.popitem(last=False)
+    return root
 
-    EntityTypes = []
 
+def load_schema_file_from_tree(filename):
+    root = load_xml_tree(filename)
+
+    schema_file = SchemaFile(filename)
     for reference in root.findall(
         "{http://docs.oasis-open.org/odata/ns/edmx}Reference"
     ):
-        uri = reference.attrib["Uri"]
-        namespaces = []
-        for include in root.findall(
-            "{http://docs.oasis-open.org/odata/ns/edmx}Include"
-        ):
-            ns = include.attrib["Namespace"]
-            alias = include.attrib.get("Alias", ns)
-            namespaces.append((ns, alias))
-        references.append((uri, namespaces))
+        schema_file.references.append(reference_from_element(reference))
 
-    data_services = root.findall(
-        "{http://docs.oasis-open.org/odata/ns/edmx}DataServices"
-    )
-    for ds in data_services:
+    for ds in root.findall("{http://docs.oasis-open.org/odata/ns/edmx}DataServices"):
         for element in ds:
-            if element.tag == "{http://docs.oasis-open.org/odata/ns/edm}Schema":
+            if element.tag != "{http://docs.oasis-open.org/odata/ns/edm}Schema":
+                continue
+            namespace = element.attrib["Namespace"]
+            alias = element.attrib.get("Alias", None)
+            for schema_element in element:
+                if schema_element.tag in indexed_tags:
+                    schema_file.add_record(
+                        type_record_from_element(namespace, schema_element), alias
+                    )
+    return schema_file
+
+
+def load_schema_file_streaming(filename):
+    schema_file = SchemaFile(filename)
+
+    # Only elements directly inside DataServices/Schema are types; anything
+    # else is cleared as soon as it has been read
+    path = []
+    namespace = None
+    alias = None
+    for event, element in ET.iterparse(filename, events=("start", "end")):
+        if event == "start":
+            path.append(element.tag)
+            if (
+                element.tag == "{http://docs.oasis-open.org/odata/ns/edm}Schema"
+                and path[-2:-1]
+                == ["{http://docs.oasis-open.org/odata/ns/edmx}DataServices"]
+            ):
                 namespace = element.attrib["Namespace"]
-                if len(namespaces_to_check) == 0 or namespace in namespaces_to_check:
-                    for schema_element in element:
-                        name = schema_element.attrib.get("Name", None)
-                        if name != None:
-                            scoped_name = namespace + "." + name
-                        else:
-                            scoped_name = ""
-
-                        # TODO(ed) It would be better if name, and scopename were
-                        # combined so this was one search instead of two
-                        if (
-                            element_name_filter is not None
-                            and name != element_name_filter
-                            and scoped_name != element_name_filter
-                        ):
-                            continue
-
-                        if (
-                            schema_element.tag
-                            == "{http://docs.oasis-open.org/odata/ns/edm}EntityType"
-                        ):
-                            basetypename = schema_element.attrib.get("BaseType", None)
-                            abstract = (
-                                schema_element.attrib.get("Abstract", "false") == "true"
-                            )
-                            if basetypename is not None:
-                                basetype = find_element_in_scope(
-                                    basetypename, references, filename
-                                )
-                                if basetype is None:
-                                    print(
-                                        "Unable to find basetype {}".format(
-                                            basetypename
-                                        )
-                                    )
-                            else:
-                                basetype = None
-                            basetype_flat = []
-                            if basetype is not None:
-                                basetype_flat.append(basetype)
-                                if isinstance(basetype, EntityType):
-                                    basetype_flat.extend(basetype.basetype_flat)
-                            entity = EntityType(
-                                name,
-                                basetype,
-                                basetype_flat,
-                                namespace,
-                                abstract,
-                                filename,
-                            )
+                alias = element.attrib.get("Alias", None)
+            continue
 
-                            for property_element in schema_element:
-                                permission = PropertyPermissions.READ_WRITE
-                                description = ""
-                                long_description = ""
-                                if (
-                                    property_element.tag
-                                    == "{http://docs.oasis-open.org/odata/ns/edm}Property"
-                                ):
-                                    prop_type = property_element.attrib["Type"]
-                                    property_entity = find_element_in_scope(
-                                        prop_type, references, filename
-                                    )
-                                    if property_entity is None:
-                                        print(
-                                            "Unable to find type for {}".format(
-                                                prop_type
-                                            )
-                                        )
-                                    for child in property_element:
-                                        if (
-                                            child.tag
-                                            == "{http://docs.oasis-open.org/odata/ns/edm}Annotation"
-                                        ):
-                                            term = child.attrib.get("Term", "")
-                                            if term == "OData.Permissions":
-                                                perm = child.attrib.get(
-                                                    "EnumMember", ""
-                                                )
-                                                if perm == "OData.Permission/Read":
-                                                    permission = (
-                                                        PropertyPermissions.READ_ONLY
-                                                    )
-                                            elif term == "OData.Description":
-                                                description = child.attrib.get(
-                                                    "String", ""
-                                                )
-                                            elif term == "OData.LongDescription":
-                                                long_description = child.attrib.get(
-                                                    "String", ""
-                                                )
-                                    # TODO(ed) subprocessor has a circular import
-                                    if (
-                                        property_element.attrib["Name"]
-                                        in circular_imports
-                                    ):
-                                        pass
-                                    else:
-                                        entity.properties.append(
-                                            Property(
-                                                property_element.attrib["Name"],
-                                                property_entity,
-                                                permission,
-                                                description,
-                                                long_description,
-                                                filename,
-                                            )
-                                        )
-                                elif (
-                                    property_element.tag
-                                    == "{http://docs.oasis-open.org/odata/ns/edm}NavigationProperty"
-                                ):
-                                    expand_references = False
-                                    auto_expand = False
-                                    prop_type = property_element.attrib["Type"]
-                                    property_entity = find_element_in_scope(
-                                        prop_type, references, filename
-                                    )
-                                    contains_target = (
-                                        property_element.attrib.get(
-                                            "ContainsTarget", "false"
-                                        )
-                                        == "true"
-                                    )
-                                    if property_entity is None:
-                                        print(
-                                            "Unable to find type for {}".format(
-                                                prop_type
-                                            )
-                                        )
-                                    for child in property_element:
-                                        term = child.attrib.get("Term", "")
-                                        if term == "OData.AutoExpandReferences":
-                                            expand_references = True
-                                        elif term == "OData.AutoExpand":
-                                            auto_expand = True
-                                        elif term == "OData.Permissions":
-                                            perm = child.attrib.get("EnumMember", "")
-                                            if perm == "OData.Permission/Read":
-                                                permission = (
-                                                    PropertyPermissions.READ_ONLY
-                                                )
-                                        elif term == "OData.Description":
-                                            description = child.attrib.get("String", "")
-                                        elif term == "OData.LongDescription":
-                                            long_description = child.attrib.get(
-                                                "String", ""
-                                            )
-                                    # TODO(ed) subprocessor has a circular import
-                                    if (
-                                        property_element.attrib["Name"]
-                                        in circular_imports
-                                    ):
-                                        pass
-                                    else:
-                                        entity.properties.append(
-                                            NavigationProperty(
-                                                property_element.attrib["Name"],
-                                                property_entity,
-                                                permission,
-                                                auto_expand,
-                                                expand_references,
-                                                description,
-                                                long_description,
-                                                filename,
-                                                contains_target,
-                                            )
-                                        )
-
-                            EntityTypes.append(entity)
-
-                            # print("{} {}".format(namespace, name))
-                        if (
-                            schema_element.tag
-                            == "{http://docs.oasis-open.org/odata/ns/edm}EnumType"
-                        ):
-                            enums = []
-                            for member in schema_element.findall(
-                                "{http://docs.oasis-open.org/odata/ns/edm}Member"
-                            ):
-                                enums.append(member.attrib["Name"])
-
-                            EntityTypes.append(Enum(name, enums, namespace, filename))
-                        if (
-                            schema_element.tag
-                            == "{http://docs.oasis-open.org/odata/ns/edm}ComplexType"
-                        ):
-                            EntityTypes.append(Complex(name, namespace, filename))
-
-                        if (
-                            schema_element.tag
-                            == "{http://docs.oasis-open.org/odata/ns/edm}TypeDefinition"
-                        ):
-                            underlying_type = schema_element.attrib["UnderlyingType"]
-
-                            typedef_entity = find_element_in_scope(
-                                underlying_type, references, filename
-                            )
-                            EntityTypes.append(
-                                TypeDef(name, typedef_entity, namespace, filename)
-                            )
+        path.pop()
+        parent = path[-1] if len(path) != 0 else None
+        if (
+            element.tag == "{http://docs.oasis-open.org/odata/ns/edmx}Reference"
+            and len(path) == 1
+        ):
+            schema_file.references.append(reference_from_element(element))
+            element.clear()
+        elif parent == "{http://docs.oasis-open.org/odata/ns/edm}Schema":
+            if namespace is not None and element.tag in indexed_tags:
+                schema_file.add_record(
+                    type_record_from_element(namespace, element), alias
+                )
+            element.clear()
+        elif element.tag == "{http://docs.oasis-open.org/odata/ns/edm}Schema":
+            namespace = None
+            alias = None
+            element.clear()
+    return schema_file
+
+
+if lxml is not None:
+    lxml_parser = lxml.etree.XMLParser(remove_comments=True, remove_pis=True)
+    lxml_namespaces = {
+        "edmx": "http://docs.oasis-open.org/odata/ns/edmx",
+        "edm": "http://docs.oasis-open.org/odata/ns/edm",
+    }
+    lxml_find_references = lxml.etree.XPath(
+        "/*/edmx:Reference", namespaces=lxml_namespaces
+    )
+    lxml_find_schemas = lxml.etree.XPath(
+        "/*/edmx:DataServices/edm:Schema", namespaces=lxml_namespaces
+    )
+    lxml_find_types = lxml.etree.XPath(
+        "edm:EntityType | edm:EnumType | edm:ComplexType | edm:TypeDefinition",
+        namespaces=lxml_namespaces,
+    )
+
+
+def load_schema_file_lxml(filename):
+    if lxml is None:
+        raise Exception("The lxml backend needs the lxml package installed")
+    root = lxml.etree.parse(filename, lxml_parser)
 
+    schema_file = SchemaFile(filename)
+    for reference in lxml_find_references(root):
+        schema_file.references.append(reference_from_element(reference))
+
+    for schema in lxml_find_schemas(root):
+        namespace = schema.attrib["Namespace"]
+        alias = schema.attrib.get("Alias", None)
+        for schema_element in lxml_find_types(schema):
+            schema_file.add_record(
+                type_record_from_element(namespace, schema_element), alias
+            )
+    return schema_file
+
+
+class ExpatSchemaHandler:
+    # Builds the records for one file from expat events, keeping nothing but
+    # the stack of open tags
+    def __init__(self, filename):
+        self.schema_file = SchemaFile(filename)
+        self.path = []
+        self.namespace = None
+        self.alias = None
+        self.reference = None
+        self.record = None
+        self.record_depth = 0
+        self.property_record = None
+        # Set while inside a Redfish.Uris annotation, and inside one of its
+        # strings
+        self.in_uris = False
+        self.uri = None
+
+    def start(self, tag, attrib):
+        if "}" in tag:
+            tag = "{" + tag
+        parent = self.path[-1] if len(self.path) != 0 else None
+        self.path.append(tag)
+
+        if self.property_record is not None:
+            if len(self.path) != self.record_depth + 2:
+                return
+            navigation = self.property_record.navigation
+            if (
+                not navigation
+                and tag != "{http://docs.oasis-open.org/odata/ns/edm}Annotation"
+            ):
+                return
+            term = attrib.get("Term", "")
+            if term == "OData.AutoExpandReferences" and navigation:
+                self.property_record.expand_references = True
+            elif term == "OData.AutoExpand" and navigation:
+                self.property_record.auto_expand = True
+            elif term == "OData.Permissions":
+                if attrib.get("EnumMember", "") == "OData.Permission/Read":
+                    self.property_record.read_only = True
+        elif self.in_uris:
+            if (
+                len(self.path) == self.record_depth + 3
+                and parent == "{http://docs.oasis-open.org/odata/ns/edm}Collection"
+                and tag == "{http://docs.oasis-open.org/odata/ns/edm}String"
+            ):
+                self.uri = []
+        elif self.record is not None:
+            if len(self.path) != self.record_depth + 1:
+                return
+            if (
+                self.record.tag == "{http://docs.oasis-open.org/odata/ns/edm}EntityType"
+                and tag
+                in [
+                    "{http://docs.oasis-open.org/odata/ns/edm}Property",
+                    "{http://docs.oasis-open.org/odata/ns/edm}NavigationProperty",
+                ]
+            ):
+                self.property_record = PropertyRecord(
+                    attrib["Name"],
+                    attrib["Type"],
+                    tag
+                    == "{http://docs.oasis-open.org/odata/ns/edm}NavigationProperty",
+                    False,
+                    False,
+                    False,
+                    attrib.get("ContainsTarget", "false") == "true",
+                )
+            elif (
+                self.record.tag == "{http://docs.oasis-open.org/odata/ns/edm}EnumType"
+                and tag == "{http://docs.oasis-open.org/odata/ns/edm}Member"
+            ):
+                self.record.members.append(sys.intern(attrib["Name"]))
+            elif (
+                self.record.tag == "{http://docs.oasis-open.org/odata/ns/edm}EntityType"
+                and tag == "{http://docs.oasis-open.org/odata/ns/edm}Annotation"
+                and attrib.get("Term", None) == "Redfish.Uris"
+            ):
+                self.in_uris = True
+        elif self.reference is not None:
+            if (
+                len(self.path) == 3
+                and tag == "{http://docs.oasis-open.org/odata/ns/edmx}Include"
+            ):
+                ns = attrib["Namespace"]
+                self.reference[1].append((ns, attrib.get("Alias", ns)))
+        elif (
+            tag == "{http://docs.oasis-open.org/odata/ns/edmx}Reference"
+            and len(self.path) == 2
+        ):
+            self.reference = (attrib["Uri"], [])
+        elif (
+            tag == "{http://docs.oasis-open.org/odata/ns/edm}Schema"
+            and parent == "{http://docs.oasis-open.org/odata/ns/edmx}DataServices"
+        ):
+            self.namespace = attrib["Namespace"]
+            self.alias = attrib.get("Alias", None)
+        elif (
+            parent == "{http://docs.oasis-open.org/odata/ns/edm}Schema"
+            and self.namespace is not None
+            and tag in indexed_tags
+        ):
+            self.record = TypeRecord(
+                tag,
+                attrib.get("Name", None),
+                self.namespace,
+                attrib.get("BaseType", None),
+                attrib.get("Abstract", "false") == "true",
+                attrib.get("UnderlyingType", None),
+            )
+            self.record_depth = len(self.path)
+
+    def text(self, data):
+        if self.uri is not None:
+            self.uri.append(data)
+
+    def end(self, tag):
+        depth = len(self.path)
+        tag = self.path.pop()
+        if self.property_record is not None:
+            if depth == self.record_depth + 1:
+                self.record.properties.append(self.property_record)
+                self.property_record = None
+        elif self.in_uris:
+            if self.uri is not None and depth == self.record_depth + 3:
+                self.record.uris.append(sys.intern("".join(self.uri).strip()))
+                self.uri = None
+            elif depth == self.record_depth + 1:
+                self.in_uris = False
+        elif self.record is not None:
+            if depth == self.record_depth:
+                self.schema_file.add_record(self.record, self.alias)
+                self.record = None
+        elif self.reference is not None:
+            if depth == 2:
+                self.schema_file.references.append(self.reference)
+                self.reference = None
+        elif tag == "{http://docs.oasis-open.org/odata/ns/edm}Schema":
+            self.namespace = None
+            self.alias = None
+
+
+def load_schema_file_expat(filename):
+    handler = ExpatSchemaHandler(filename)
+    parser = xml.parsers.expat.ParserCreate(namespace_separator="}")
+    parser.StartElementHandler = handler.start
+    parser.EndElementHandler = handler.end
+    parser.CharacterDataHandler = handler.text
+    with open(filename, "rb") as filehandle:
+        if os.fstat(filehandle.fileno()).st_size == 0:
+            parser.Parse(b"", True)
+        else:
+            with mmap.mmap(filehandle.fileno(), 0, access=mmap.ACCESS_READ) as contents:
+                parser.Parse(contents, True)
+    return handler.schema_file
+
+
+xml_backends = {
+    "iterparse": load_schema_file_streaming,
+    "etree": load_schema_file_from_tree,
+    "lxml": load_schema_file_lxml,
+    "expat": load_schema_file_expat,
+}
+
+
+# filename to SchemaFile
+symbol_index = {}
+
+
+def index_file(filename):
+    schema_file = symbol_index.get(filename, None)
+    if schema_file is not None:
+        return schema_file
+
+    cache_key = None
+    if PARSE_CACHE_DIR is not None:
+        cache_key = file_digest(filename)
+        schema_file = read_parse_cache("records", cache_key)
+    if schema_file is not None:
+        counters["records_cache_hits"] += 1
+        schema_file.filename = filename
+    else:
+        counters["files_parsed"] += 1
+        schema_file = xml_backends[xml_backend](filename)
+        if cache_key is not None:
+            write_parse_cache("records", cache_key, schema_file)
+
+    symbol_index[filename] = schema_file
+    return schema_file
+
+
+def init_parse_worker(parse_cache_dir, backend, cache_size):
+    global PARSE_CACHE_DIR
+    global xml_backend
+    global xml_cache_size
+    PARSE_CACHE_DIR = parse_cache_dir
+    xml_backend = backend
+    xml_cache_size = cache_size
+
+
+def load_schema_records(filename):
+    # Runs in the parse pool, so it only reads the file into flat records;
+    # nothing is resolved until the records are back in the parent.  What it
+    # counted is handed back too, as the worker's own counters are discarded.
+    start = Counter(counters)
+    schema_file = index_file(filename)
+    return schema_file, counters - start
+
+
+def build_symbol_index(directory, jobs=1):
+    # Index every schema up front so that lookups never need to walk a tree
+    filepaths = []
+    for root, dirs, files in os.walk(directory):
+        for filename in sorted(files):
+            filepath = os.path.join(root, filename)
+            if filename.endswith(".xml") and filepath not in symbol_index:
+                filepaths.append(filepath)
+
+    if jobs <= 1 or len(filepaths) < 2:
+        for filepath in filepaths:
+            index_file(filepath)
+        return
+
+    with make_pool(
+        min(jobs, len(filepaths)),
+        initializer=init_parse_worker,
+        initargs=(PARSE_CACHE_DIR, xml_backend, xml_cache_size),
+    ) as p:
+        results = p.map(load_schema_records, filepaths, chunksize=4)
+    for filepath, (schema_file, worker_counters) in zip(filepaths, results):
+        counters.update(worker_counters)
+        symbol_index[filepath] = schema_file
+
+
+def parse_schema_element(record, references, filename):
+    if record.tag == "{http://docs.oasis-open.org/odata/ns/edm}EntityType":
+        if record.base_type is not None:
+            basetype = find_element_in_scope(record.base_type, references, filename)
+            if basetype is None:
+                print("Unable to find basetype {}".format(record.base_type))
+        else:
+            basetype = None
+        basetype_flat = []
+        if basetype is not None:
+            basetype_flat.append(basetype)
+            if isinstance(basetype, EntityType):
+                basetype_flat.extend(basetype.basetype_flat)
+        entity = EntityType(
+            record.name,
+            basetype,
+            basetype_flat,
+            record.namespace,
+            record.abstract,
+            filename,
+        )
+        entity.uris = record.uris
+        owner = sys.intern(record.namespace + "." + record.name)
+        for property_record in record.properties:
+            permission = PropertyPermissions.READ_WRITE
+            if property_record.read_only:
+                permission = PropertyPermissions.READ_ONLY
+            if property_record.navigation:
+                entity.properties.append(
+                    NavigationProperty(
+                        property_record.name,
+                        property_record.type_name,
+                        references,
+                        permission,
+                        property_record.auto_expand,
+                        property_record.expand_references,
+                        filename,
+                        property_record.contains_target,
+                        owner,
+                    )
+                )
+            else:
+                entity.properties.append(
+                    Property(
+                        property_record.name,
+                        property_record.type_name,
+                        references,
+                        permission,
+                        filename,
+                        owner,
+                    )
+                )
+
+        return entity
+
+    if record.tag == "{http://docs.oasis-open.org/odata/ns/edm}EnumType":
+        return Enum(record.name, list(record.members), record.namespace, filename)
+
+    if record.tag == "{http://docs.oasis-open.org/odata/ns/edm}ComplexType":
+        return Complex(record.name, record.namespace, filename)
+
+    if record.tag == "{http://docs.oasis-open.org/odata/ns/edm}TypeDefinition":
+        typedef_entity = find_element_in_scope(
+            record.underlying_type, references, filename
+        )
+        return TypeDef(record.name, typedef_entity, record.namespace, filename)
+    return None
+
+
+class ResolutionCache:
+    def __init__(self):
+        # (qualified type name, defining file) to the resolved type
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key in self.entries:
+            self.hits += 1
+            return True, self.entries[key]
+        self.misses += 1
+        return False, None
+
+    def put(self, key, value):
+        self.entries[key] = value
+
+    def clear(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+
+resolution_cache = ResolutionCache()
+
+
+def resolve_schema_element(record, references, filename):
+    # Every reference to the same schema element resolves to the same object,
+    # so a type and its basetype chain are only ever built once
+    if record.name is None:
+        return parse_schema_element(record, references, filename)
+
+    key = (record.namespace + "." + record.name, filename)
+    found, entity = resolution_cache.get(key)
+    if found:
+        return entity
+    entity = parse_schema_element(record, references, filename)
+    resolution_cache.put(key, entity)
+    return entity
+
+
+def parse_file(filename, namespaces_to_check=[], element_name_filter=None):
+    schema_file = index_file(filename)
+
+    if element_name_filter is not None:
+        records = schema_file.lookup(element_name_filter, namespaces_to_check)
+    else:
+        records = [
+            record
+            for record in schema_file.records
+            if len(namespaces_to_check) == 0 or record.namespace in namespaces_to_check
+        ]
+
+    EntityTypes = []
+    for record in records:
+        entity = resolve_schema_element(record, schema_file.references, filename)
+        if entity is not None:
+            EntityTypes.append(entity)
     return EntityTypes
 
 
-def parse_toplevel(filepath):
-    print("Parsing {}".format(filepath))
-    return parse_file(filepath)
+_generator_version = None
+
+
+def generator_version():
+    # Any change to the generator invalidates everything it has cached
+    global _generator_version
+    if _generator_version is None:
+        _generator_version = file_digest(os.path.realpath(__file__))
+    return _generator_version
+
+
+def file_digest(filename):
+    with open(filename, "rb") as filehandle:
+        return hashlib.sha256(filehandle.read()).hexdigest()
+
+
+def parse_cache_key(*parts):
+    # Pickles name the module of every class in them, and a run that imports
+    # the generator has different classes to one that runs it as a script
+    digest = hashlib.sha256(generator_version().encode())
+    digest.update(b"\0")
+    digest.update(__name__.encode())
+    for part in parts:
+        digest.update(b"\0")
+        digest.update(part.encode())
+    return digest.hexdigest()
+
+
+def parse_cache_path(kind, key):
+    return os.path.join(PARSE_CACHE_DIR, kind, parse_cache_key(key) + ".pickle")
+
+
+def read_parse_cache(kind, key):
+    if PARSE_CACHE_DIR is None:
+        return None
+    try:
+        with open(parse_cache_path(kind, key), "rb") as filehandle:
+            return pickle.load(filehandle)
+    except FileNotFoundError:
+        return None
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError) as e:
+        print("Ignoring unreadable {} cache entry: {}".format(kind, e))
+        return None
+
+
+def write_parse_cache(kind, key, value):
+    if PARSE_CACHE_DIR is None:
+        return
+    filepath = parse_cache_path(kind, key)
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    # Write to a temporary file first so that concurrent workers never see a
+    # partially written entry
+    temp_filepath = "{}.{}.tmp".format(filepath, os.getpid())
+    with open(temp_filepath, "wb") as filehandle:
+        pickle.dump(value, filehandle, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_filepath, filepath)
+
+
+def parse_toplevel(latest_types):
+    # Only the newest version of each type is resolved here; older versions
+    # are built on demand when a newer one names them as its BaseType
+    flat_list = []
+    for filepath, record in latest_types.values():
+        schema_file = index_file(filepath)
+        entity = resolve_schema_element(record, schema_file.references, filepath)
+        if entity is not None:
+            flat_list.append(entity)
+    return flat_list
 
 
 def get_grpc_filename_from_entity(entity):
@@ -505,9 +1327,7 @@ def generate_properties_for_entity(typedef, index_start, message_name, package_n
             grpc_out += "    // from {}.{}\n".format(typedef.namespace, typedef.name)
 
         for property_obj in typedef.properties:
-            if isinstance(property_obj, NavigationProperty) and not (
-                property_obj.contains_target or property_obj.auto_expand
-            ):
+            if not is_inlined(property_obj):
                 grpc_type = "NavigationReference"
                 if isinstance(property_obj.type, Collection):
                     grpc_type = "repeated " + grpc_type
@@ -529,15 +1349,7 @@ def generate_properties_for_entity(typedef, index_start, message_name, package_n
     return grpc_out, required_imports, property_index
 
 
-def generate_grpc_for_type(typedef):
-    filepath = get_grpc_filename_from_entity(typedef)
-    # make the path absolute
-    filepath = os.path.join(GRPC_DIR, filepath)
-    try:
-        os.makedirs(os.path.dirname(filepath))
-    except FileExistsError:
-        pass
-
+def render_grpc_for_type(typedef):
     required_imports = []
 
     grpc_out = ""
@@ -581,10 +1393,72 @@ def generate_grpc_for_type(typedef):
     if len(required_imports) != 0:
         file_out += "\n"
     file_out += grpc_out
+    return file_out
+
+
+def generate_grpc_for_type(typedef):
+    filepath = get_grpc_filename_from_entity(typedef)
+    # make the path absolute
+    filepath = os.path.join(GRPC_DIR, filepath)
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+
+    changed = write_output_file(filepath, render_grpc_for_type(typedef))
+    return filepath, changed
+
+
+# The types being emitted, as seen by emission pool workers
+emission_types = []
 
-    with open(filepath, "w") as grpc_file:
-        grpc_file.write(file_out)
-    write_meson_file_for_proto(filepath)
+
+def make_pool(processes, initializer=None, initargs=()):
+    return get_context(start_method).Pool(
+        processes, initializer=initializer, initargs=initargs
+    )
+
+
+def init_emission_worker(flat_list, grpc_dir):
+    global emission_types
+    global GRPC_DIR
+    emission_types = flat_list
+    GRPC_DIR = grpc_dir
+
+
+def emit_grpc_for_index(index):
+    return generate_grpc_for_type(emission_types[index])
+
+
+def emit_grpc_for_types(flat_list, batches, jobs):
+    # Each batch of indexes is emitted once the batch before it is written.
+    # Workers only render and write files; the results come back in the order
+    # of the batches so the caller can record them exactly as a serial run
+    # would.
+    indexes = [index for batch in batches for index in batch]
+    if jobs <= 1 or len(indexes) < 2:
+        return [generate_grpc_for_type(flat_list[index]) for index in indexes]
+    results = []
+    with make_pool(
+        jobs, initializer=init_emission_worker, initargs=(flat_list, GRPC_DIR)
+    ) as p:
+        for batch in batches:
+            results.extend(p.map(emit_grpc_for_index, batch, chunksize=16))
+    for filepath, _changed in results:
+        if os.path.commonpath([filepath, GRPC_DIR]) != GRPC_DIR:
+            raise Exception(
+                "Emission worker wrote {} outside of {}".format(filepath, GRPC_DIR)
+            )
+    return results
+
+
+def write_output_file(filepath, text):
+    # Files whose contents haven't changed are left alone so that their
+    # timestamps, and anything protoc built from them, stay valid
+    if os.path.exists(filepath):
+        with open(filepath) as filehandle:
+            if filehandle.read() == text:
+                return False
+    with open(filepath, "w") as filehandle:
+        filehandle.write(text)
+    return True
 
 
 def write_fixed_messages():
@@ -594,8 +1468,7 @@ def write_fixed_messages():
     nav_out += "}"
 
     filepath = os.path.join(GRPC_DIR, "NavigationReference.proto")
-    with open(filepath, "w") as nav:
-        nav.write(nav_out)
+    write_output_file(filepath, nav_out)
     write_meson_file_for_proto(filepath)
 
 
@@ -621,108 +1494,379 @@ def clear_and_make_output_dirs():
         os.makedirs(PROTO_OUT_DIR)
 
 
-def get_properties_for_service_root(entity, path="", depth=0, collectionlist=[]):
+# Navigation properties to follow below ServiceRoot when generating the per
+# path RPCs, or None to follow every path
+max_path_depth = None
+
+
+class ServicePath:
+    __slots__ = ("names", "resource", "in_collection", "owner")
+
+    def __init__(self, names, resource, in_collection, owner):
+        # Navigation properties followed to get here
+        self.names = names
+        self.resource = resource
+        # Whether the path goes through a collection, so needs an ID
+        self.in_collection = in_collection
+        # The entity declaring the last navigation property, or None
+        self.owner = owner
+
+
+service_paths_cache = {}
+
+
+def get_service_paths(entity):
+    return walk_service_paths(entity, False, 0, ())[0]
+
+
+def walk_service_paths(entity, in_collection, depth, active):
+    # Every path from entity that gets an RPC, along with the ancestors in
+    # active that cut the walk short and the resources walked through.  What's
+    # below a type only depends on the type, whether a collection has been
+    # gone through and which of those resources are on the path above it, so
+    # it's walked once per combination, and only prefixed with the navigation
+    # property it is reached by.  A type that's already on the path isn't
+    # followed again.
+    while isinstance(entity, (Collection, TypeDef)):
+        if isinstance(entity, Collection):
+            in_collection = True
+            entity = entity.contained_type
+        else:
+            entity = entity.basetype
+    if not isinstance(entity, EntityType):
+        return [], frozenset(), frozenset()
+
+    remaining = None if max_path_depth is None else max_path_depth - depth
+    cache_key = (entity, in_collection, remaining)
+    cached = service_paths_cache.get(cache_key)
+    if cached is not None:
+        paths, cuts, walked = cached
+        # The same ancestors have to cut it, and none of the resources below
+        # may be an ancestor now, or the walk would go differently
+        if cuts.issubset(active) and walked.isdisjoint(active):
+            counters["service_paths_cache_hits"] += 1
+            return cached
+
+    paths = [ServicePath((), entity, in_collection, None)]
+    resource_key = get_resource_key(entity)
+    cuts = set()
+    walked = {resource_key}
+    active = active + (resource_key,)
+    owners = []
+    owner = entity
+    while isinstance(owner, EntityType) and remaining != 0:
+        owners.insert(0, owner)
+        owner = owner.basetype
+    for owner in owners:
+        owner_name = owner.namespace + "." + owner.name
+        for property_obj in owner.properties:
+            if not isinstance(property_obj, NavigationProperty):
+                continue
+            target = get_named_type(property_obj.type)
+            while isinstance(target, TypeDef):
+                target = target.basetype
+            if isinstance(target, EntityType) and get_resource_key(target) in active:
+                counters["service_path_cycles"] += 1
+                cuts.add(get_resource_key(target))
+                continue
+            children, child_cuts, child_walked = walk_service_paths(
+                property_obj.type, in_collection, depth + 1, active
+            )
+            cuts.update(child_cuts)
+            walked.update(child_walked)
+            for child in children:
+                paths.append(
+                    ServicePath(
+                        (property_obj.name,) + child.names,
+                        child.resource,
+                        child.in_collection,
+                        owner_name if len(child.names) == 0 else child.owner,
+                    )
+                )
+    # Cutting at this resource happens wherever it's walked from
+    cuts.discard(resource_key)
+    cached = (paths, frozenset(cuts), frozenset(walked))
+    service_paths_cache[cache_key] = cached
+    return cached
+
+
+def get_service_path_shard(service_path):
+    # Paths are served from the shard of the ServiceRoot navigation property
+    # they start with
+    if len(service_path.names) == 0:
+        return None
+    return service_path.names[0]
+
+
+def group_service_paths(service_root):
+    grouped_paths = OrderedDict()
+    for service_path in get_service_paths(service_root):
+        shard = get_service_path_shard(service_path)
+        grouped_paths.setdefault(shard, []).append(service_path)
+    return grouped_paths
+
+
+def get_properties_for_service_paths(service_paths):
     body = ""
     header = []
     messages = ""
 
-    # TODO(ed) What do collections look like?
-    if isinstance(entity, Collection):
-        collectionlist = list(collectionlist)
-        collectionlist.append(path)
-        return get_properties_for_service_root(
-            entity.contained_type, path, 0, collectionlist
+    for service_path in service_paths:
+        path = "_".join(("ServiceRoot",) + service_path.names)
+        resource = service_path.resource
+
+        if service_path.owner is not None:
+            body += "\n    // from {}\n".format(service_path.owner)
+
+        messages += "\n"
+        messages += "message Get_{}_FilterSpec{{\n".format(path)
+        messages += "    string expand = 1;\n"
+        messages += "    repeated string filter = 2;\n"
+        # TODO(ed) Figure out how to name routes with multiple IDs
+        if service_path.in_collection:
+            messages += "    NavigationReference {}Id = 3;\n".format(
+                path.split("_")[-1]
+            )
+        messages += "}\n"
+
+        body += "    rpc Get_{0}(Get_{0}_FilterSpec) returns ({1}.{2}) {{}};\n".format(
+            path, resource.namespace.split(".")[0], resource.name
         )
+        header.append('import "{}";\n'.format(get_grpc_filename_from_entity(resource)))
 
-    if isinstance(entity, TypeDef):
-        # Note, because typedefs aren't a real "property" they don't increase
-        # depth
-        return get_properties_for_service_root(entity.basetype, path, 0, collectionlist)
-
-    if isinstance(entity, EntityType):
-        if path == "":
-            path = "ServiceRoot"
-
-        # only generate service definition for root level objects
-        if depth == 0:
-            messages += "\n"
-            messages += "message Get_{}_FilterSpec{{\n".format(path)
-            messages += "    string expand = 1;\n"
-            messages += "    repeated string filter = 2;\n"
-
-            for element_index, element in enumerate(collectionlist):
-                messages += "    NavigationReference {}Id = {};\n".format(
-                    path.split("_")[-1], element_index + 3
-                )
+    return body, header, messages
 
-                # TODO(ed) Figure out how to name routes with multiple IDs
-                break
 
-            messages += "}\n"
+# Also generate the RPC per navigation path from ServiceRoot that the service
+# used to be made of, alongside the one RPC per resource type
+path_rpcs = False
 
-            body += (
-                "    rpc Get_{0}(Get_{0}_FilterSpec) returns ({1}.{2}) {{}};\n".format(
-                    path, entity.namespace.split(".")[0], entity.name
-                )
-            )
-            filename = get_grpc_filename_from_entity(entity)
-            header.append('import "{}";\n'.format(filename))
+# Also generate a server-streaming RPC for every collection, which sends its
+# members one at a time as they're fetched
+stream_collections = False
 
-        if entity.basetype != None:
-            this_body, this_header, this_messages = get_properties_for_service_root(
-                entity.basetype, path, depth + 1, collectionlist
-            )
-            body += this_body
-            header.extend(this_header)
-            messages += this_messages
 
+def get_resource_key(entity):
+    # Every version of a resource shares one message, so one RPC
+    return (entity.namespace.split(".")[0], entity.name)
+
+
+def get_resource_rpc_name(entity, verb="Get"):
+    package = entity.namespace.split(".")[0]
+    if entity.name == package:
+        return verb + entity.name
+    return verb + package + entity.name
+
+
+def get_emitted_resources(flat_list):
+    emitted = {}
+    for thistype in flat_list:
+        if isinstance(thistype, EntityType):
+            emitted[get_resource_key(thistype)] = thistype
+    return emitted
+
+
+def get_collection_member(entity, emitted):
+    # The resource type of a collection's Members, or None if entity isn't a
+    # collection
+    while isinstance(entity, EntityType):
         for property_obj in entity.properties:
+            if property_obj.name != "Members":
+                continue
             if not isinstance(property_obj, NavigationProperty):
                 continue
-            new_path = path + "_" + property_obj.name
-            if new_path.startswith("_"):
-                new_path = new_path[1:]
+            if not isinstance(property_obj.type, Collection):
+                continue
+            member = get_named_type(property_obj.type)
+            if isinstance(member, EntityType):
+                return emitted.get(get_resource_key(member), member)
+        entity = entity.basetype
+    return None
 
-            body += "\n    // from {}\n".format(entity.namespace + "." + entity.name)
 
-            this_body, this_header, this_messages = get_properties_for_service_root(
-                property_obj.type, new_path, 0, collectionlist
-            )
-            body += this_body
-            header.extend(this_header)
-            messages += this_messages
+def get_resource_shards(service_root, flat_list):
+    # Every resource type that can be navigated to from ServiceRoot, once
+    # each, in the order they're first reached, along with the ServiceRoot
+    # navigation property that names the service shard it's served from.
+    # ServiceRoot itself has no shard.  Navigation properties can name an
+    # older version of a type, so the version that was emitted is used in its
+    # place.
+    emitted = get_emitted_resources(flat_list)
+    resources = OrderedDict()
+    pending = deque([(service_root, None)])
+    while len(pending) != 0:
+        entity, shard = pending.popleft()
+        key = get_resource_key(entity)
+        if key in resources:
+            continue
+        entity = emitted.get(key, entity)
+        resources[key] = (entity, shard)
+        while isinstance(entity, EntityType):
+            for property_obj in entity.properties:
+                if not isinstance(property_obj, NavigationProperty):
+                    continue
+                target = get_named_type(property_obj.type)
+                if isinstance(target, EntityType):
+                    pending.append(
+                        (target, property_obj.name if shard is None else shard)
+                    )
+            entity = entity.basetype
 
-    return body, header, messages
+    # A resource is often reachable from several areas, ComputerSystem from
+    # both Systems and StorageSystems for one, so the area its first URI is
+    # under wins over the one it happened to be reached through first
+    shards = set(x[1] for x in resources.values())
+    for key, (entity, shard) in resources.items():
+        for uri in get_resource_uris(entity)[:1]:
+            segments = RouteTable.split_uri(uri)
+            if len(segments) > 2 and segments[2] in shards:
+                resources[key] = (entity, segments[2])
+    return list(resources.values())
 
 
-def write_service_root(flat_list):
+def get_service_root(flat_list):
     service_root = [x for x in flat_list if x.name == "ServiceRoot"]
     if len(service_root) != 1:
         raise Exception("Unable to find unique service root")
-    proto_filename = os.path.join(GRPC_DIR, "entry.proto")
-    with open(proto_filename, "w") as service_file:
-        service_file.write('syntax = "proto3";\n\n')
-        service_file.write("package redfish_v1;\n\n")
+    return service_root[0]
+
+
+def get_service_name(shard):
+    if shard is None:
+        return "Redfish_v1"
+    return "Redfish_v1_" + shard
+
+
+def get_service_filename(shard):
+    if shard is None:
+        return "entry.proto"
+    return "entry_{}.proto".format(shard)
+
+
+class ServiceShard:
+    __slots__ = ("name", "header", "messages", "body")
+
+    def __init__(self, name):
+        # The ServiceRoot navigation property served, or None for ServiceRoot
+        self.name = name
+        self.header = []
+        self.messages = ""
+        self.body = ""
+
+
+def get_service_shards(flat_list):
+    # One service per ServiceRoot navigation property, each in its own proto,
+    # so protoc and the compiler can work on them in parallel, and changing
+    # one area of the schema only rebuilds its shard
+    service_root = get_service_root(flat_list)
+    emitted = get_emitted_resources(flat_list)
+    shards = OrderedDict()
+    shards[None] = ServiceShard(None)
+    for resource, shard in get_resource_shards(service_root, flat_list):
+        if shard not in shards:
+            shards[shard] = ServiceShard(shard)
+        service_shard = shards[shard]
+        service_shard.body += (
+            "    rpc {}(GetResourceRequest) returns ({}.{}) {{}};\n".format(
+                get_resource_rpc_name(resource),
+                resource.namespace.split(".")[0],
+                resource.name,
+            )
+        )
+        service_shard.header.append(
+            'import "{}";\n'.format(get_grpc_filename_from_entity(resource))
+        )
+        if shard is not None:
+            # for GetResourceRequest
+            service_shard.header.append('import "entry.proto";\n')
+
+        member = (
+            get_collection_member(resource, emitted) if stream_collections else None
+        )
+        if member is not None:
+            service_shard.body += (
+                "    rpc {}(GetResourceRequest) returns (stream {}.{}) {{}};\n".format(
+                    get_resource_rpc_name(resource, "Stream"),
+                    member.namespace.split(".")[0],
+                    member.name,
+                )
+            )
+            service_shard.header.append(
+                'import "{}";\n'.format(get_grpc_filename_from_entity(member))
+            )
 
-        body, header, messages = get_properties_for_service_root(service_root[0])
+    if path_rpcs:
+        for shard, service_paths in group_service_paths(service_root).items():
+            if shard not in shards:
+                shards[shard] = ServiceShard(shard)
+            service_shard = shards[shard]
+            path_body, path_header, path_messages = get_properties_for_service_paths(
+                service_paths
+            )
+            service_shard.body += (
+                "\n    // One RPC per navigation path from ServiceRoot\n"
+            )
+            service_shard.body += path_body
+            service_shard.header.extend(path_header)
+            if any(x.in_collection for x in service_paths):
+                service_shard.header.append('import "NavigationReference.proto";\n')
+            service_shard.messages += path_messages
+    return list(shards.values())
+
+
+# The shard protos written by the last write_service_root
+service_shard_files = []
+
+
+def write_service_root(flat_list):
+    service_shard_files.clear()
+    for shard in get_service_shards(flat_list):
+        proto_filename = os.path.join(GRPC_DIR, get_service_filename(shard.name))
+        service_out = 'syntax = "proto3";\n\n'
+        service_out += "package redfish_v1;\n\n"
+
+        messages = "\n"
+        if shard.name is None:
+            messages += "// Addresses any resource by its URI, for example\n"
+            messages += (
+                "// /redfish/v1/Chassis/1.  expand and filter are passed through as\n"
+            )
+            messages += "// the $expand and $filter query parameters.\n"
+            messages += "message GetResourceRequest{\n"
+            messages += "    string odata_id = 1;\n"
+            messages += "    string expand = 2;\n"
+            messages += "    repeated string filter = 3;\n"
+            messages += "}\n"
+        messages += shard.messages
 
-        header.append('import "NavigationReference.proto";\n')
         # deduplicate headers
-        header = sorted(set(header), key=str.casefold)
+        header = sorted(set(shard.header), key=str.casefold)
         for header_element in header:
-            service_file.write(header_element)
+            service_out += header_element
+
+        service_out += messages
 
-        service_file.write(messages)
+        service_out += "service {}{{\n".format(get_service_name(shard.name))
+        service_out += shard.body
+        service_out += "}"
+        write_output_file(proto_filename, service_out)
+        write_meson_file_for_proto(proto_filename)
+        if shard.name is not None:
+            service_shard_files.append(get_service_filename(shard.name))
 
-        service_file.write("service Redfish_v1{\n")
-        service_file.write(body)
-        service_file.write("}")
-    write_meson_file_for_proto(proto_filename)
+    # Shards that no longer exist would otherwise be left behind by
+    # --incremental
+    for filename in os.listdir(GRPC_DIR):
+        if filename.startswith("entry_") and filename.endswith(".proto"):
+            if filename not in service_shard_files:
+                remove_generated_proto(filename)
 
 
 def get_cpp_for_type(
-    name, property_obj, indent_level, val_level, main_object_available
+    name, property_obj, indent_level, val_level, main_object_available, expanding=()
 ):
+    # expanding holds the entities whose conversion is being generated, so a
+    # type that nests itself isn't expanded forever
     body = ""
 
     indent1 = "    " * indent_level
@@ -735,7 +1879,7 @@ def get_cpp_for_type(
 
     if isinstance(property_obj, TypeDef):
         body += get_cpp_for_type(
-            name, property_obj.basetype, indent_level, val_level, False
+            name, property_obj.basetype, indent_level, val_level, False, expanding
         )
 
     if property_obj == BaseType.STRING or property_obj == BaseType.GUID:
@@ -803,7 +1947,9 @@ def get_cpp_for_type(
         # todo(ed)
         pass
     if isinstance(property_obj, NavigationProperty):
-        body += get_cpp_for_type("", property_obj.type, indent_level, val_level, False)
+        body += get_cpp_for_type(
+            "", property_obj.type, indent_level, val_level, False, expanding
+        )
     if isinstance(property_obj, Collection):
         body += indent1 + "if (value{}.is_array())\n".format(val_level)
         body += indent1 + "{\n"
@@ -823,11 +1969,21 @@ def get_cpp_for_type(
         )
 
         body += get_cpp_for_type(
-            name, property_obj.contained_type, indent_level + 3, val_level, True
+            name,
+            property_obj.contained_type,
+            indent_level + 3,
+            val_level,
+            True,
+            expanding,
         )
         body += indent2 + "}\n"
         body += indent1 + "}\n"
-    if isinstance(property_obj, EntityType):
+    if isinstance(property_obj, EntityType) and property_obj in expanding:
+        body += indent1 + "// {} nests itself; nested values aren't converted\n".format(
+            get_type_name(property_obj)
+        )
+    elif isinstance(property_obj, EntityType):
+        expanding = expanding + (property_obj,)
         if main_object_available:
             body += indent1 + "auto* responsevalue{} = responsevalue{};\n".format(
                 val_level + 1, val_level
@@ -860,19 +2016,24 @@ def get_cpp_for_type(
 
                 body += 'if (key{} == "{}")\n'.format(val_level, property_node.name)
                 body += indent3 + "{\n"
-                if isinstance(property_node, NavigationProperty):
-                    if property_node.auto_expand or property_node.contains_target:
+                if isinstance(property_node, NavigationProperty) or not is_inlined(
+                    property_node
+                ):
+                    if is_inlined(property_node):
                         body += get_cpp_for_type(
                             property_node.name,
                             property_node.type,
                             indent_level + 3,
                             val_level,
                             False,
+                            expanding,
                         )
                     # TODO(ed) Navigation references should be special cased
                     # less by passing "expanding references" to calling scopes
-                    elif property_node.expand_references and isinstance(
-                        property_node.type, Collection
+                    elif (
+                        isinstance(property_node, NavigationProperty)
+                        and property_node.expand_references
+                        and isinstance(property_node.type, Collection)
                     ):
                         body += indent4 + "if (value{}.is_array())\n".format(val_level)
                         body += indent4 + "{\n"
@@ -949,6 +2110,7 @@ def get_cpp_for_type(
                         indent_level,
                         val_level,
                         False,
+                        expanding,
                     )
                 body += indent3 + "}\n"
                 prop_index += 1
@@ -960,90 +2122,495 @@ def get_cpp_for_type(
     return body
 
 
-def generate_cpp_for_entity(
-    entity, path="", url_path="/redfish/v1", inherit_depth=0, collectionlist=[]
-):
-    body = ""
+resource_cpp_cache = {}
 
-    # TODO(ed) What do collections look like?
-    if isinstance(entity, Collection):
-        collectionlist = list(collectionlist)
-        collectionlist.append(path)
-        return generate_cpp_for_entity(
-            entity.contained_type, path, url_path, 0, collectionlist
-        )
 
-    if isinstance(entity, TypeDef):
-        # Note, because typedefs aren't a real "property" they don't increase
-        # inherit_depth
-        return generate_cpp_for_entity(
-            entity.basetype, path, url_path, 0, collectionlist
-        )
+def get_cpp_for_resource_body(entity):
+    # The conversion of a resource is the same whichever RPC returns it
+    body = resource_cpp_cache.get(entity)
+    if body is None:
+        body = get_cpp_for_type("sroot", entity, 2, 0, True)
+        resource_cpp_cache[entity] = body
+    return body
 
-    if isinstance(entity, EntityType):
-        if path == "":
-            path = "ServiceRoot"
 
-        # only generate service definition for root level objects
-        if inherit_depth == 0:
-            body += "    grpc::Status Get_{}(\n".format(path)
-            body += "        grpc::ServerContext* context ,\n"
-            body += "        const redfish_v1::Get_{}_FilterSpec* request,\n".format(
-                path
-            )
-            body += "        {0}::{1}* responsevalue0) override\n".format(
-                entity.namespace.split(".")[0], entity.name
-            )
+def generate_cpp_for_service_paths(service_paths, url_path="/redfish/v1"):
+    body = []
 
-            body += "    {\n"
-            # TODO(ed) this is a bad approximation, and wont work for
-            # multi-level collections like ethernet
-            if len(collectionlist) != 0:
-                newname = path.split("_")[-1].lower()
-                body += (
-                    "        const std::string& uri = request->{}id().id();\n".format(
-                        newname
-                    )
+    for service_path in service_paths:
+        path = "_".join(("ServiceRoot",) + service_path.names)
+        resource = service_path.resource
+
+        body.append("    grpc::Status Get_{}(\n".format(path))
+        body.append("        grpc::ServerContext* context ,\n")
+        body.append(
+            "        const redfish_v1::Get_{}_FilterSpec* request,\n".format(path)
+        )
+        body.append(
+            "        {0}::{1}* responsevalue0) override\n".format(
+                resource.namespace.split(".")[0], resource.name
+            )
+        )
+        body.append("    {\n")
+        # TODO(ed) this is a bad approximation, and wont work for
+        # multi-level collections like ethernet
+        if service_path.in_collection:
+            newname = path.split("_")[-1].lower()
+            body.append(
+                "        const std::string& uri = request->{}id().id();\n".format(
+                    newname
                 )
-                body += "        nlohmann::json value0 = request_uri(uri);\n"
-            else:
-                body += '        nlohmann::json value0 = request_uri("{}");\n'.format(
-                    url_path
+            )
+            body.append("        nlohmann::json value0 = request_uri(uri);\n")
+        else:
+            body.append(
+                '        nlohmann::json value0 = request_uri("{}");\n'.format(
+                    "/".join((url_path,) + service_path.names)
                 )
-            body += "\n"
-            body += get_cpp_for_type("sroot", entity, 2, 0, True)
-            body += "        return grpc::Status::OK;\n"
-            body += "    }\n\n"
-
-        if entity.basetype != None:
-            this_body = generate_cpp_for_entity(
-                entity.basetype, path, url_path, inherit_depth + 1, collectionlist
             )
-            body += this_body
+        body.append("\n")
+        body.append(get_cpp_for_resource_body(resource))
+        body.append("        return grpc::Status::OK;\n")
+        body.append("    }\n\n")
 
-        for property_obj in entity.properties:
-            if not isinstance(property_obj, NavigationProperty):
-                continue
-            new_path = path + "_" + property_obj.name
-            if new_path.startswith("_"):
-                new_path = new_path[1:]
+    return "".join(body)
 
-            new_url = url_path + "/" + property_obj.name
-            body += generate_cpp_for_entity(
-                property_obj.type, new_path, new_url, 0, collectionlist
-            )
 
+def generate_cpp_for_resource(entity):
+    body = "    grpc::Status {}(\n".format(get_resource_rpc_name(entity))
+    body += "        grpc::ServerContext* context ,\n"
+    body += "        const redfish_v1::GetResourceRequest* request,\n"
+    body += "        {0}::{1}* responsevalue0) override\n".format(
+        entity.namespace.split(".")[0], entity.name
+    )
+    body += "    {\n"
+    if entity.name == "ServiceRoot":
+        body += '        nlohmann::json value0 = request_uri("/redfish/v1");\n'
+    else:
+        body += "        nlohmann::json value0 = request_uri(request->odata_id());\n"
+    body += "\n"
+    body += get_cpp_for_resource_body(entity)
+    body += "        return grpc::Status::OK;\n"
+    body += "    }\n\n"
     return body
 
 
-def write_cpp_code(flat_list):
-    service_root = [x for x in flat_list if x.name == "ServiceRoot"]
-    if len(service_root) != 1:
-        raise Exception("Unable to find unique service root")
-    cpp_filename = os.path.join(SCRIPT_DIR, "..", "include", "grpc_defs.hpp")
-    with open(cpp_filename, "w") as cpp_file:
-        body = generate_cpp_for_entity(service_root[0])
-        cpp_file.write(body)
+def generate_cpp_for_collection_stream(collection, member):
+    # Members are fetched, converted and written one at a time, so only one
+    # is ever held, however big the collection
+    body = "    grpc::Status {}(\n".format(get_resource_rpc_name(collection, "Stream"))
+    body += "        grpc::ServerContext* context ,\n"
+    body += "        const redfish_v1::GetResourceRequest* request,\n"
+    body += "        grpc::ServerWriter<{0}::{1}>* writer) override\n".format(
+        member.namespace.split(".")[0], member.name
+    )
+    body += "    {\n"
+    body += "        nlohmann::json collection = request_uri(request->odata_id());\n"
+    body += "        if (!collection.is_object())\n"
+    body += "        {\n"
+    body += "            return grpc::Status::OK;\n"
+    body += "        }\n"
+    body += '        auto members = collection.find("Members");\n'
+    body += "        if (members == collection.end() || !members->is_array())\n"
+    body += "        {\n"
+    body += "            return grpc::Status::OK;\n"
+    body += "        }\n"
+    body += "        for (const auto& member : *members)\n"
+    body += "        {\n"
+    body += "            if (context->IsCancelled())\n"
+    body += "            {\n"
+    body += "                return grpc::Status::CANCELLED;\n"
+    body += "            }\n"
+    body += "            if (!member.is_object())\n"
+    body += "            {\n"
+    body += "                continue;\n"
+    body += "            }\n"
+    body += '            auto id = member.find("@odata.id");\n'
+    body += "            if (id == member.end() || !id->is_string())\n"
+    body += "            {\n"
+    body += "                continue;\n"
+    body += "            }\n"
+    body += "            nlohmann::json value0 = request_uri(id->get<std::string>());\n"
+    body += "            {0}::{1} response;\n".format(
+        member.namespace.split(".")[0], member.name
+    )
+    body += "            auto* responsevalue0 = &response;\n"
+    body += "\n"
+    # The same conversion GetX uses, one level further in
+    body += textwrap.indent(get_cpp_for_resource_body(member), "    ")
+    body += "            if (!writer->Write(response))\n"
+    body += "            {\n"
+    body += "                break;\n"
+    body += "            }\n"
+    body += "        }\n"
+    body += "        return grpc::Status::OK;\n"
+    body += "    }\n\n"
+    return body
+
+
+def get_cpp_filename(shard):
+    if shard is None:
+        return "grpc_defs.hpp"
+    return "grpc_defs_{}.hpp".format(shard)
+
+
+def write_cpp_code(flat_list, manifest, new_manifest):
+    # One header per service shard, holding the methods of its service
+    service_root = get_service_root(flat_list)
+    emitted = get_emitted_resources(flat_list)
+    bodies = OrderedDict()
+    bodies[None] = ""
+    for resource, shard in get_resource_shards(service_root, flat_list):
+        bodies[shard] = bodies.get(shard, "") + generate_cpp_for_resource(resource)
+        member = (
+            get_collection_member(resource, emitted) if stream_collections else None
+        )
+        if member is not None:
+            bodies[shard] += generate_cpp_for_collection_stream(resource, member)
+    if path_rpcs:
+        for shard, service_paths in group_service_paths(service_root).items():
+            bodies[shard] = bodies.get(shard, "") + generate_cpp_for_service_paths(
+                service_paths
+            )
+
+    os.makedirs(CPP_OUT_DIR, exist_ok=True)
+    cpp_filenames = []
+    for shard, body in bodies.items():
+        cpp_filenames.append(get_cpp_filename(shard))
+        header = "// Methods of redfish_v1::{}::Service\n\n".format(
+            get_service_name(shard)
+        )
+        write_output_file(
+            os.path.join(CPP_OUT_DIR, get_cpp_filename(shard)), header + body
+        )
+    new_manifest.headers = [
+        os.path.abspath(os.path.join(CPP_OUT_DIR, x)) for x in cpp_filenames
+    ]
+    # CPP_OUT_DIR is shared with other code, so only headers that an earlier
+    # run recorded writing are removed
+    if manifest is not None:
+        for filepath in sorted(set(manifest.headers) - set(new_manifest.headers)):
+            if os.path.exists(filepath):
+                print("Removing stale {}".format(filepath))
+                os.remove(filepath)
+
+
+def get_resource_uris(entity):
+    # Redfish.Uris is usually only declared on the abstract type that every
+    # version inherits from
+    while isinstance(entity, EntityType):
+        if len(entity.uris) != 0:
+            return entity.uris
+        entity = entity.basetype
+    return []
+
+
+class Route:
+    __slots__ = ("uri", "service", "rpc", "resource", "parameters")
+
+    def __init__(self, uri, service, rpc, resource, parameters):
+        # URI template, for example /redfish/v1/Chassis/{ChassisId}
+        self.uri = uri
+        self.service = service
+        self.rpc = rpc
+        self.resource = resource
+        # The {Id} names in the template, in order
+        self.parameters = parameters
+
+
+class RouteNode:
+    __slots__ = ("literals", "parameter", "route")
+
+    def __init__(self):
+        # path segment to the index of the next node
+        self.literals = {}
+        # index of the node any other segment leads to, for {Id} segments
+        self.parameter = None
+        # index of the route that ends here
+        self.route = None
+
+
+# URIs that more than one resource lists in Redfish.Uris, mapped to the
+# resource that serves them.  Any other conflict is an error.  These are
+# errata in the DMTF schemas: CircuitCollection lists the URIs of its members,
+# and Certificate the URIs of its collection.
+route_conflicts = {
+    "/redfish/v1/PowerEquipment/Switchgear/{PowerDistributionId}/Mains/{CircuitId}": "Circuit.Circuit",
+    "/redfish/v1/PowerEquipment/Switchgear/{PowerDistributionId}/Subfeeds/{CircuitId}": "Circuit.Circuit",
+    "/redfish/v1/PowerEquipment/Switchgear/{PowerDistributionId}/Feeders/{CircuitId}": "Circuit.Circuit",
+    "/redfish/v1/PowerEquipment/Switchgear/{PowerDistributionId}/Branches/{CircuitId}": "Circuit.Circuit",
+    "/redfish/v1/Systems/{ComputerSystemId}/KeyManagement/KMIPCertificates": "CertificateCollection.CertificateCollection",
+    "/redfish/v1/CompositionService/ResourceBlocks/{ResourceBlockId}/Systems/{ComputerSystemId}/KeyManagement/KMIPCertificates": "CertificateCollection.CertificateCollection",
+    "/redfish/v1/ResourceBlocks/{ResourceBlockId}/Systems/{ComputerSystemId}/KeyManagement/KMIPCertificates": "CertificateCollection.CertificateCollection",
+}
+
+
+class RouteTable:
+    # A trie over URI path segments, so matching a URI takes one step per
+    # segment however many routes there are.  Every {Id} at the same depth
+    # below the same parent shares a node, whatever it is called, so routes
+    # with several IDs need nothing special.  When matching, a literal
+    # segment is tried first, and the {Id} only when nothing below the
+    # literal matches.
+    def __init__(self):
+        self.routes = []
+        self.nodes = [RouteNode()]
+
+    @staticmethod
+    def split_uri(uri):
+        return [x for x in uri.split("/") if x != ""]
+
+    @staticmethod
+    def is_parameter(segment):
+        return segment.startswith("{") and segment.endswith("}")
+
+    def add_route(self, route):
+        for segment in self.split_uri(route.uri):
+            if ("{" in segment or "}" in segment) and not self.is_parameter(segment):
+                print("Skipping malformed route {}".format(route.uri))
+                return
+        node = self.nodes[0]
+        for segment in self.split_uri(route.uri):
+            if self.is_parameter(segment):
+                if node.parameter is None:
+                    node.parameter = len(self.nodes)
+                    self.nodes.append(RouteNode())
+                node = self.nodes[node.parameter]
+            else:
+                if segment not in node.literals:
+                    node.literals[segment] = len(self.nodes)
+                    self.nodes.append(RouteNode())
+                node = self.nodes[node.literals[segment]]
+        if node.route is not None:
+            existing = self.routes[node.route]
+            if existing.resource == route.resource:
+                return
+            resource = route_conflicts.get(route.uri, None)
+            if resource not in [existing.resource, route.resource]:
+                raise Exception(
+                    "Route {} is listed by both {} and {}; add it to "
+                    "route_conflicts to pick one".format(
+                        route.uri, existing.resource, route.resource
+                    )
+                )
+            if resource == route.resource:
+                self.routes[node.route] = route
+            return
+        node.route = len(self.routes)
+        self.routes.append(route)
+
+
+def build_route_table(flat_list):
+    route_table = RouteTable()
+    service_root = get_service_root(flat_list)
+    for resource, shard in get_resource_shards(service_root, flat_list):
+        for uri in get_resource_uris(resource):
+            route_table.add_route(
+                Route(
+                    uri,
+                    get_service_name(shard),
+                    get_resource_rpc_name(resource),
+                    "{}.{}".format(resource.namespace.split(".")[0], resource.name),
+                    [
+                        x[1:-1]
+                        for x in RouteTable.split_uri(uri)
+                        if RouteTable.is_parameter(x)
+                    ],
+                )
+            )
+    return route_table
+
+
+def render_route_table_json(route_table):
+    routes = [
+        {
+            "uri": route.uri,
+            "service": route.service,
+            "rpc": route.rpc,
+            "resource": route.resource,
+            "parameters": route.parameters,
+        }
+        for route in route_table.routes
+    ]
+    return json.dumps({"routes": routes}, indent=1) + "\n"
+
+
+def get_cpp_string_literal(text):
+    # Octal escapes, as hex ones run on into any hex digit that follows
+    literal = ""
+    for byte in text.encode("utf-8"):
+        character = chr(byte)
+        if 0x20 <= byte < 0x7F and character not in '\\"?':
+            literal += character
+        else:
+            literal += "\\{:03o}".format(byte)
+    return '"' + literal + '"'
+
+
+def render_route_table_cpp(route_table):
+    # The trie is flattened into arrays: each node's literal edges are
+    # contiguous and sorted, so a segment is found by binary search
+    edges = []
+    nodes = []
+    for node in route_table.nodes:
+        first_edge = len(edges)
+        for segment in sorted(node.literals):
+            edges.append((segment, node.literals[segment]))
+        nodes.append(
+            (
+                first_edge,
+                len(node.literals),
+                -1 if node.parameter is None else node.parameter,
+                -1 if node.route is None else node.route,
+            )
+        )
+
+    out = "#pragma once\n"
+    out += "#include <algorithm>\n"
+    out += "#include <array>\n"
+    out += "#include <cstdint>\n"
+    out += "#include <string_view>\n"
+    out += "#include <vector>\n"
+    out += "\n"
+    out += "namespace redfish_routes\n"
+    out += "{\n"
+    out += "\n"
+    out += "struct Route\n"
+    out += "{\n"
+    out += "    std::string_view uri;\n"
+    out += "    std::string_view service;\n"
+    out += "    std::string_view rpc;\n"
+    out += "    std::string_view resource;\n"
+    out += "};\n"
+    out += "\n"
+    out += "struct RouteEdge\n"
+    out += "{\n"
+    out += "    std::string_view segment;\n"
+    out += "    uint32_t node;\n"
+    out += "};\n"
+    out += "\n"
+    out += "struct RouteNode\n"
+    out += "{\n"
+    out += "    uint32_t firstEdge;\n"
+    out += "    uint32_t edgeCount;\n"
+    out += "    int32_t parameter;\n"
+    out += "    int32_t route;\n"
+    out += "};\n"
+    out += "\n"
+    out += "constexpr std::array<Route, {}> routes{{{{\n".format(
+        len(route_table.routes)
+    )
+    for route in route_table.routes:
+        out += "    {{{}, {}, {}, {}}},\n".format(
+            get_cpp_string_literal(route.uri),
+            get_cpp_string_literal(route.service),
+            get_cpp_string_literal(route.rpc),
+            get_cpp_string_literal(route.resource),
+        )
+    out += "}};\n"
+    out += "\n"
+    out += "constexpr std::array<RouteEdge, {}> routeEdges{{{{\n".format(len(edges))
+    for segment, node in edges:
+        out += "    {{{}, {}}},\n".format(get_cpp_string_literal(segment), node)
+    out += "}};\n"
+    out += "\n"
+    out += "constexpr std::array<RouteNode, {}> routeNodes{{{{\n".format(len(nodes))
+    for node in nodes:
+        out += "    {{{}, {}, {}, {}}},\n".format(*node)
+    out += "}};\n"
+    out += "\n"
+    out += "// Matches segments from index on, starting at node.  A literal edge is\n"
+    out += "// tried before the node's {Id}, which is tried if nothing below the\n"
+    out += "// literal matches.\n"
+    out += "inline int matchRouteFrom(uint32_t node,\n"
+    out += "                          const std::vector<std::string_view>& segments,\n"
+    out += "                          size_t index,\n"
+    out += "                          std::vector<std::string_view>& ids)\n"
+    out += "{\n"
+    out += "    const RouteNode& current = routeNodes[node];\n"
+    out += "    if (index == segments.size())\n"
+    out += "    {\n"
+    out += "        return current.route;\n"
+    out += "    }\n"
+    out += "    std::string_view segment = segments[index];\n"
+    out += "    auto first = routeEdges.begin() + current.firstEdge;\n"
+    out += "    auto last = first + current.edgeCount;\n"
+    out += "    auto edge = std::lower_bound(\n"
+    out += "        first, last, segment,\n"
+    out += "        [](const RouteEdge& e, std::string_view s) {\n"
+    out += "            return e.segment < s;\n"
+    out += "        });\n"
+    out += "    if (edge != last && edge->segment == segment)\n"
+    out += "    {\n"
+    out += "        int route = matchRouteFrom(edge->node, segments, index + 1, ids);\n"
+    out += "        if (route >= 0)\n"
+    out += "        {\n"
+    out += "            return route;\n"
+    out += "        }\n"
+    out += "    }\n"
+    out += "    if (current.parameter >= 0)\n"
+    out += "    {\n"
+    out += "        ids.push_back(segment);\n"
+    out += (
+        "        int route = matchRouteFrom(static_cast<uint32_t>(current.parameter),\n"
+    )
+    out += "                                   segments, index + 1, ids);\n"
+    out += "        if (route >= 0)\n"
+    out += "        {\n"
+    out += "            return route;\n"
+    out += "        }\n"
+    out += "        ids.pop_back();\n"
+    out += "    }\n"
+    out += "    return -1;\n"
+    out += "}\n"
+    out += "\n"
+    out += "// Returns the index in routes of the route uri matches, or -1, and fills\n"
+    out += "// ids with the value of every {Id} in it, or leaves it empty if nothing\n"
+    out += "// matches.\n"
+    out += "inline int matchRoute(std::string_view uri,\n"
+    out += "                      std::vector<std::string_view>& ids)\n"
+    out += "{\n"
+    out += "    ids.clear();\n"
+    out += '    uri = uri.substr(0, uri.find_first_of("?#"));\n'
+    out += "    std::vector<std::string_view> segments;\n"
+    out += "    while (!uri.empty())\n"
+    out += "    {\n"
+    out += "        size_t end = uri.find('/');\n"
+    out += "        std::string_view segment = uri.substr(0, end);\n"
+    out += "        uri.remove_prefix(end == std::string_view::npos ? uri.size()\n"
+    out += "                                                        : end + 1);\n"
+    out += "        if (!segment.empty())\n"
+    out += "        {\n"
+    out += "            segments.push_back(segment);\n"
+    out += "        }\n"
+    out += "    }\n"
+    out += "    int route = matchRouteFrom(0, segments, 0, ids);\n"
+    out += "    if (route < 0)\n"
+    out += "    {\n"
+    out += "        ids.clear();\n"
+    out += "    }\n"
+    out += "    return route;\n"
+    out += "}\n"
+    out += "\n"
+    out += "} // namespace redfish_routes\n"
+    return out
+
+
+def write_route_table(flat_list):
+    route_table = build_route_table(flat_list)
+    write_output_file(
+        os.path.join(GRPC_DIR, "routes.json"), render_route_table_json(route_table)
+    )
+    os.makedirs(CPP_OUT_DIR, exist_ok=True)
+    write_output_file(
+        os.path.join(CPP_OUT_DIR, "grpc_routes.hpp"),
+        render_route_table_cpp(route_table),
+    )
+    print(
+        "Route table: {} routes, {} trie nodes".format(
+            len(route_table.routes), len(route_table.nodes)
+        )
+    )
 
 
 # TODO(ed) this shouldn't be a global
@@ -1052,20 +2619,24 @@ folders_added_to_grpc = []
 
 def write_meson_root_config():
     filepath = os.path.join(GRPC_DIR, "meson.build")
-    with open(filepath, "w") as filehandle:
-        filehandle.write("protobuf_generated = []\n")
-
-        for filename in sorted(folders_added_to_grpc):
-            filehandle.write("protobuf_generated += proto_gen.process( \\\n")
-            filehandle.write("    '{}', \\\n".format(filename))
-            filehandle.write("    preserve_path_from : meson.current_source_dir() \\\n")
-            filehandle.write(")\n")
-            # filehandle.write("subdir('{}')\n".format(filename))
-
-        filehandle.write("protobuf_generated += grpc_gen.process(\n")
-        filehandle.write("'entry.proto',\n")
-        filehandle.write("preserve_path_from : meson.current_source_dir()")
-        filehandle.write(")\n")
+    meson_out = "protobuf_generated = []\n"
+
+    for filename in sorted(folders_added_to_grpc):
+        meson_out += "protobuf_generated += proto_gen.process( \\\n"
+        meson_out += "    '{}', \\\n".format(filename)
+        meson_out += "    preserve_path_from : meson.current_source_dir() \\\n"
+        meson_out += ")\n"
+        # meson_out += "subdir('{}')\n".format(filename)
+
+    # Every service shard is its own generated source, so they compile in
+    # parallel and rebuild independently
+    meson_out += "protobuf_generated += grpc_gen.process(\n"
+    meson_out += "'entry.proto',\n"
+    for filename in sorted(service_shard_files):
+        meson_out += "'{}',\n".format(filename)
+    meson_out += "preserve_path_from : meson.current_source_dir()"
+    meson_out += ")\n"
+    write_output_file(filepath, meson_out)
 
 
 def write_meson_file_for_proto(inputpath):
@@ -1089,119 +2660,1222 @@ def get_lowest_type(this_class, depth=0):
     return get_lowest_type(this_class.basetype, depth + 1)
 
 
-def find_type_for_abstract(class_list, abs):
+def index_abstract_types(class_list):
+    # (name, file) of the abstract type at the bottom of each class's
+    # inheritance chain, to the first class in class_list that inherits it
+    abstract_types = {}
     for element in class_list:
         lt = get_lowest_type(element)
-        if lt.name == abs.name and lt.from_file == abs.from_file:
-            return element
-    """
-    for element in class_list:
-        lt = get_lowest_type(element)
-        if lt.name == abs.name:
-            return element
-    """
-    return abs
-
-
-def instantiate_abstract_classes(class_list, this_class):
-    if isinstance(this_class, EntityType):
-        for class_to_fix in [this_class] + this_class.basetype_flat:
-            if isinstance(class_to_fix, EntityType):
-                for property_instance in class_to_fix.properties:
-                    if isinstance(property_instance, NavigationProperty):
-                        property_instance.type = find_type_for_abstract(
-                            class_list, property_instance.type
-                        )
-                    if isinstance(property_instance, Property):
-                        property_instance.type = find_type_for_abstract(
-                            class_list, property_instance.type
+        abstract_types.setdefault((lt.name, lt.from_file), element)
+    return abstract_types
+
+
+def find_type_for_abstract(abstract_types, abs):
+    key = (getattr(abs, "name", None), getattr(abs, "from_file", None))
+    return abstract_types.get(key, abs)
+
+
+def instantiate_abstract_classes(class_list):
+    # Replace every reference to an abstract type with the concrete type that
+    # implements it.  Each class is only walked once, and the graph can
+    # contain cycles until break_type_cycles runs.
+    abstract_types = index_abstract_types(class_list)
+    visited = set()
+    pending = list(reversed(class_list))
+    while len(pending) != 0:
+        this_class = pending.pop()
+        if isinstance(this_class, Collection):
+            this_class.contained_type = find_type_for_abstract(
+                abstract_types, this_class.contained_type
+            )
+            continue
+        if not isinstance(this_class, EntityType) or this_class in visited:
+            continue
+        visited.add(this_class)
+        for property_instance in this_class.properties:
+            property_instance.type = find_type_for_abstract(
+                abstract_types, property_instance.type
+            )
+            pending.append(property_instance.type)
+        if this_class.basetype is not None:
+            pending.append(this_class.basetype)
+
+
+def drop_unresolved_properties(flat_list):
+    # Only called with --allow-missing-schemas; otherwise the first property
+    # whose type can't be found fails the run as it is resolved
+    visited = set()
+    for thistype in flat_list:
+        while isinstance(thistype, EntityType) and thistype not in visited:
+            visited.add(thistype)
+            for property_obj in list(thistype.properties):
+                if get_named_type(property_obj.type) is None:
+                    print(
+                        "Leaving out {}.{}, its type couldn't be found".format(
+                            get_type_name(thistype), property_obj.name
                         )
-        for class_to_fix in [this_class] + this_class.basetype_flat:
-            if isinstance(class_to_fix, EntityType):
-                for property_instance in class_to_fix.properties:
-                    instantiate_abstract_classes(class_list, property_instance.type)
-
-            if isinstance(class_to_fix, Collection):
-                class_to_fix.contained_type = find_type_for_abstract(
-                    class_list, class_to_fix.contained_type
-                )
-    if isinstance(this_class, Collection):
-        this_class.contained_type = find_type_for_abstract(
-            class_list, this_class.contained_type
+                    )
+                    thistype.properties.remove(property_obj)
+            thistype = thistype.basetype
+
+
+def get_named_type(object_type):
+    # Collections aren't types of their own in the type graph
+    while isinstance(object_type, Collection):
+        object_type = object_type.contained_type
+    return object_type
+
+
+class TypeDependency:
+    __slots__ = ("target", "owner", "property_obj")
+
+    def __init__(self, target, owner, property_obj):
+        self.target = target
+        # The entity declaring property_obj, or None for a basetype
+        self.owner = owner
+        self.property_obj = property_obj
+
+
+class TypeGraph:
+    def __init__(self, roots):
+        # every named type reachable from roots, in discovery order
+        self.nodes = []
+        # type to the list of TypeDependency it has
+        self.dependencies = {}
+        for root in roots:
+            self.add_reachable(root)
+
+    @staticmethod
+    def get_dependencies(node, references=False):
+        # Only the types a message nests are edges of the graph, as only
+        # those can form a cycle; references adds the targets of
+        # NavigationReferences too
+        dependencies = []
+        if isinstance(node, EntityType):
+            if node.basetype is not None:
+                dependencies.append(TypeDependency(node.basetype, None, None))
+            for property_obj in node.properties:
+                if not references and not is_inlined(property_obj):
+                    continue
+                target = get_named_type(property_obj.type)
+                dependencies.append(TypeDependency(target, node, property_obj))
+        elif isinstance(node, TypeDef):
+            dependencies.append(TypeDependency(node.basetype, None, None))
+        return [
+            dependency
+            for dependency in dependencies
+            if isinstance(dependency.target, (EntityType, Enum, Complex, TypeDef))
+        ]
+
+    def add_reachable(self, root):
+        if root in self.dependencies:
+            return
+        self.dependencies[root] = self.get_dependencies(root)
+        self.nodes.append(root)
+        pending = [root]
+        while len(pending) != 0:
+            node = pending.pop()
+            for dependency in self.dependencies[node]:
+                if dependency.target not in self.dependencies:
+                    self.dependencies[dependency.target] = self.get_dependencies(
+                        dependency.target
+                    )
+                    self.nodes.append(dependency.target)
+                    pending.append(dependency.target)
+
+    def strongly_connected_components(self):
+        # Iterative Tarjan, so deep schemas can't hit the recursion limit
+        index = {}
+        lowlink = {}
+        on_stack = set()
+        stack = []
+        components = []
+        for start in self.nodes:
+            if start in index:
+                continue
+            work = [(start, iter(self.dependencies[start]))]
+            index[start] = lowlink[start] = len(index)
+            stack.append(start)
+            on_stack.add(start)
+            while len(work) != 0:
+                node, dependencies = work[-1]
+                advanced = False
+                for dependency in dependencies:
+                    target = dependency.target
+                    if target not in index:
+                        index[target] = lowlink[target] = len(index)
+                        stack.append(target)
+                        on_stack.add(target)
+                        work.append((target, iter(self.dependencies[target])))
+                        advanced = True
+                        break
+                    if target in on_stack:
+                        lowlink[node] = min(lowlink[node], index[target])
+                if advanced:
+                    continue
+                work.pop()
+                if len(work) != 0:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.remove(member)
+                        component.append(member)
+                        if member is node:
+                            break
+                    components.append(component)
+        return components
+
+    def cycles(self):
+        cycles = []
+        for component in self.strongly_connected_components():
+            if len(component) > 1:
+                cycles.append(component)
+            elif any(
+                dependency.target is component[0]
+                for dependency in self.dependencies[component[0]]
+            ):
+                cycles.append(component)
+        return cycles
+
+    def back_edges(self):
+        # Dependencies that lead back to a type still being walked, visiting
+        # types in node order.  Removing all of them leaves the graph acyclic.
+        visited = set()
+        back_edges = []
+        for start in self.nodes:
+            if start in visited:
+                continue
+            visited.add(start)
+            walking = set([start])
+            work = [(start, iter(self.dependencies[start]))]
+            while len(work) != 0:
+                node, dependencies = work[-1]
+                advanced = False
+                for dependency in dependencies:
+                    target = dependency.target
+                    if target in walking:
+                        back_edges.append(dependency)
+                    elif target not in visited:
+                        visited.add(target)
+                        walking.add(target)
+                        work.append((target, iter(self.dependencies[target])))
+                        advanced = True
+                        break
+                if not advanced:
+                    walking.remove(node)
+                    work.pop()
+        return back_edges
+
+    def levels(self):
+        # Types grouped so that every type only nests types in earlier levels,
+        # or in a cycle of its own, which shares its level.  Types within a
+        # level are independent of each other.
+        level = {}
+        # Tarjan finds a component only after every component it depends on
+        for component in self.strongly_connected_components():
+            members = set(component)
+            component_level = 1 + max(
+                [
+                    level[dependency.target]
+                    for node in component
+                    for dependency in self.dependencies[node]
+                    if dependency.target not in members
+                ],
+                default=-1,
+            )
+            for node in component:
+                level[node] = component_level
+        levels = []
+        for node in self.nodes:
+            while len(levels) <= level[node]:
+                levels.append([])
+            levels[level[node]].append(node)
+        return levels
+
+
+def get_type_name(typedef):
+    return "{}.{}".format(typedef.namespace, typedef.name)
+
+
+def break_type_cycles(flat_list):
+    # Messages can nest themselves, as the C++ converter stops expanding a
+    # type that is already being expanded, but each type has a proto of its
+    # own, and protos can't import each other in a circle.  Where a cycle
+    # spans several protos, the property closing it is sent as a
+    # NavigationReference instead.  flat_list has ServiceRoot first, so the
+    # property changed is the one furthest from ServiceRoot.
+    graph = TypeGraph(flat_list)
+    cycles = graph.cycles()
+    cycle_protos = {}
+    for cycle in cycles:
+        protos = set(get_grpc_filename_from_entity(x) for x in cycle)
+        for node in cycle:
+            cycle_protos[node] = protos
+    for back_edge in graph.back_edges():
+        if back_edge.owner is None:
+            raise Exception(
+                "Inheritance cycle through {}".format(get_type_name(back_edge.target))
+            )
+        if len(cycle_protos[back_edge.owner]) == 1:
+            continue
+        print(
+            "Breaking circular reference {}.{} -> {} with a NavigationReference".format(
+                get_type_name(back_edge.owner),
+                back_edge.property_obj.name,
+                get_type_name(back_edge.target),
+            )
         )
+        back_edge.property_obj.by_reference = True
+    print(
+        "Type graph: {} types, {} cycles, {} levels".format(
+            len(graph.nodes), len(cycles), len(graph.levels())
+        )
+    )
+    return graph
+
+
+def prune_unreachable_types(flat_list, root_names):
+    # Only types that entry.proto can return, directly or through a property
+    # or basetype of something it returns, need a proto of their own.  Roots
+    # are given as a bare type name or as Namespace.Name.
+    roots = []
+    for root_name in root_names:
+        matches = [
+            x
+            for x in flat_list
+            if root_name in [x.name, x.namespace.split(".")[0] + "." + x.name]
+        ]
+        if len(matches) == 0:
+            raise Exception("Unable to find root type {}".format(root_name))
+        roots.extend(matches)
+
+    # Properties can name an older version of a type than the one emitted,
+    # but every version shares the same proto, so reachability is tracked by
+    # proto and the emitted version is walked along with the one named
+    emitted = {}
+    for thistype in flat_list:
+        emitted[get_grpc_filename_from_entity(thistype)] = thistype
+    reachable_protos = set()
+    visited = set()
+    pending = list(roots)
+    while len(pending) != 0:
+        node = pending.pop()
+        if node in visited:
+            continue
+        visited.add(node)
+        relpath = get_grpc_filename_from_entity(node)
+        reachable_protos.add(relpath)
+        if relpath in emitted:
+            pending.append(emitted[relpath])
+        for dependency in TypeGraph.get_dependencies(node, references=True):
+            pending.append(dependency.target)
+
+    reachable = []
+    for thistype in flat_list:
+        if get_grpc_filename_from_entity(thistype) in reachable_protos:
+            reachable.append(thistype)
+        else:
+            print("Dropping unreachable {}".format(get_type_name(thistype)))
+    print(
+        "Kept {} of {} types reachable from {}".format(
+            len(reachable), len(flat_list), ", ".join(root_names)
+        )
+    )
+    return reachable
+
+
+def split_namespace_version(namespace):
+    # "Chassis.v1_19_0" to ("Chassis", (1, 19, 0)); an unversioned namespace
+    # sorts before every versioned one
+    unversioned, _, version = namespace.rpartition(".")
+    if unversioned != "" and version.startswith("v"):
+        parts = version[1:].split("_")
+        if all(part.isdigit() for part in parts):
+            return unversioned, tuple(int(part) for part in parts)
+    return namespace, ()
+
+
+def index_latest_versions(filepaths):
+    # (root namespace, type name) to the (filepath, TypeRecord) of the newest
+    # version, picked from the namespace names alone
+    latest = OrderedDict()
+    versions = {}
+    skipped = 0
+    for filepath in filepaths:
+        for record in index_file(filepath).records:
+            if record.name is None:
+                continue
+            unversioned, version = split_namespace_version(record.namespace)
+            key = (unversioned.split(".")[0], record.name)
+            if key in latest:
+                skipped += 1
+                if version < versions[key]:
+                    continue
+            latest[key] = (filepath, record)
+            versions[key] = version
+    print(
+        "Resolving {} types, skipped {} superseded versions".format(
+            len(latest), skipped
+        )
+    )
+    return latest
 
 
-def remove_old_schemas(flat_list):
-    # remove all but the last schema version for a type by loading them into a
-    # dict with Namespace + name
-    elements = {}
-    for item in flat_list:
-        elements[item.namespace.split(".")[0] + item.name] = item
-    flat_list = [elements[item] for item in elements]
-    return flat_list
-
-
-def main():
-    gen_protos = True
-    gen_cpp = True
-    if gen_protos:
-        flat_list = []
-
-        print("Reading from {}".format(REDFISH_SCHEMA_DIR))
-        for root, dirs, files in os.walk(REDFISH_SCHEMA_DIR):
-            # Todo(ed) Oem account service is totally wrong odata wise, and
-            # its type naming conflicts with the "real" account service
-            filepaths = [
+def get_schema_filepaths():
+    filepaths = []
+    for root, dirs, files in os.walk(REDFISH_SCHEMA_DIR):
+        # Todo(ed) Oem account service is totally wrong odata wise, and
+        # its type naming conflicts with the "real" account service
+        filepaths.extend(
+            [
                 os.path.join(root, filename)
                 for filename in files
                 if not filename.startswith("OemAccountService")
             ]
-            if multithread:
-                with Pool(int(cpu_count() / 2)) as p:
-                    out = p.map(parse_toplevel, filepaths)
+        )
+    return filepaths
 
-                    flat_list.extend([item for sublist in out for item in sublist])
-            else:
 
-                for filepath in filepaths:
-                    out = parse_toplevel(filepath)
-                    flat_list.extend(out)
+def get_input_digests(filepaths):
+    return {filepath: file_digest(filepath) for filepath in filepaths}
 
-        flat_list = remove_old_schemas(flat_list)
+
+def is_usable_type_graph(flat_list, root_names):
+    # Types unpickled as some other module's classes fail every isinstance
+    # check without an error, and would generate next to nothing
+    if not all(isinstance(x, (EntityType, Enum, Complex, TypeDef)) for x in flat_list):
+        return False
+    for root_name in root_names or ["ServiceRoot"]:
+        if not any(
+            isinstance(x, EntityType)
+            and root_name in [x.name, x.namespace.split(".")[0] + "." + x.name]
+            for x in flat_list
+        ):
+            return False
+    return True
+
+
+def load_type_graph(input_digests, jobs=1, root_names=None):
+    # Types not reachable from root_names are dropped before the passes that
+    # read property types, so their properties are never resolved.  None
+    # keeps every type.
+    print("Reading from {}".format(REDFISH_SCHEMA_DIR))
+    filepaths = list(input_digests)
+
+    graph_key = None
+    if PARSE_CACHE_DIR is not None:
+        graph_key = "\n".join(
+            "{} {}".format(filepath, input_digests[filepath])
+            for filepath in sorted(filepaths)
+        )
+        graph_key += "\nroots {}".format(root_names)
+        graph_key += "\nallow missing {}".format(allow_missing_schemas)
+        flat_list = read_parse_cache("graph", graph_key)
+        if flat_list is not None and is_usable_type_graph(flat_list, root_names):
+            print("Loaded resolved types from {}".format(PARSE_CACHE_DIR))
+            return flat_list
+        if flat_list is not None:
+            print("Ignoring cached types that this generator can't use")
+
+    # Parsing is spread over the pool, but resolution happens once, here,
+    # against the shared index
+    build_symbol_index(REDFISH_SCHEMA_DIR, jobs)
+    with phase("resolve"):
+        flat_list = parse_toplevel(index_latest_versions(filepaths))
 
         flat_list.sort(key=lambda x: x.name.lower())
         flat_list.sort(key=lambda x: not x.name.startswith("ServiceRoot"))
-        for element in flat_list:
-            instantiate_abstract_classes(flat_list, element)
+    if root_names is not None:
+        with phase("prune"):
+            flat_list = prune_unreachable_types(flat_list, root_names)
+    # Property types resolve as these passes first touch them
+    with phase("abstract_types"):
+        if allow_missing_schemas:
+            drop_unresolved_properties(flat_list)
+        instantiate_abstract_classes(flat_list)
+    with phase("type_cycles"):
+        break_type_cycles(flat_list)
+
+    print(
+        "Type resolution cache: {} hits, {} misses".format(
+            resolution_cache.hits, resolution_cache.misses
+        )
+    )
+
+    if graph_key is not None:
+        write_parse_cache("graph", graph_key, flat_list)
+    return flat_list
+
+
+def add_named_type_files(object_type, files):
+    if isinstance(object_type, Collection):
+        add_named_type_files(object_type.contained_type, files)
+    elif isinstance(object_type, TypeDef):
+        files.add(object_type.from_file)
+        add_named_type_files(object_type.basetype, files)
+    elif isinstance(object_type, (EntityType, Enum, Complex)):
+        files.add(object_type.from_file)
+
+
+def get_proto_dependencies(typedef):
+    # The schema files whose contents can change the proto generated for
+    # typedef: its own, those of its basetypes, and those of the types its
+    # properties name
+    files = set()
+    add_named_type_files(typedef, files)
+    while isinstance(typedef, EntityType):
+        files.add(typedef.from_file)
+        for property_obj in typedef.properties:
+            add_named_type_files(property_obj.type, files)
+        typedef = typedef.basetype
+    add_named_type_files(typedef, files)
+    return files
+
+
+def describe_type(object_type):
+    if isinstance(object_type, Collection):
+        return "Collection({})".format(describe_type(object_type.contained_type))
+    if isinstance(object_type, (EntityType, Enum, Complex, TypeDef)):
+        return "{} {}".format(get_type_name(object_type), object_type.from_file)
+    return str(object_type)
+
+
+def get_proto_shape(typedef):
+    # A digest of what the passes over the whole graph decided for typedef:
+    # the type each property names once abstract types are instantiated, and
+    # whether it's nested or referenced once cycles are broken.  A change to
+    # one schema file can change these for types in files that didn't change.
+    parts = [describe_type(typedef)]
+    while isinstance(typedef, EntityType):
+        parts.append(describe_type(typedef))
+        for property_obj in typedef.properties:
+            parts.append(
+                "{} {} {}".format(
+                    property_obj.name,
+                    describe_type(property_obj.type),
+                    is_inlined(property_obj),
+                )
+            )
+        typedef = typedef.basetype
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+
+class OutputManifest:
+    def __init__(self, generator):
+        self.generator = generator
+        # schema file to the digest of its contents
+        self.inputs = {}
+        # proto, relative to GRPC_DIR, to the schema files it depends on
+        self.outputs = {}
+        # proto, relative to GRPC_DIR, to the get_proto_shape it was made from
+        self.shapes = {}
+        # headers written to CPP_OUT_DIR, as absolute paths
+        self.headers = []
+
+    @staticmethod
+    def path():
+        return os.path.join(PARSE_CACHE_DIR, "outputs.json")
+
+    @staticmethod
+    def load():
+        if PARSE_CACHE_DIR is None:
+            return None
+        try:
+            with open(OutputManifest.path()) as filehandle:
+                data = json.load(filehandle)
+        except (OSError, ValueError):
+            return None
+        manifest = OutputManifest(data.get("generator", None))
+        manifest.inputs = data.get("inputs", {})
+        manifest.outputs = {
+            output: set(inputs) for output, inputs in data.get("outputs", {}).items()
+        }
+        manifest.shapes = data.get("shapes", {})
+        manifest.headers = data.get("headers", [])
+        return manifest
+
+    def save(self):
+        if PARSE_CACHE_DIR is None:
+            return
+        os.makedirs(PARSE_CACHE_DIR, exist_ok=True)
+        data = {
+            "generator": self.generator,
+            "inputs": self.inputs,
+            "outputs": {
+                output: sorted(inputs) for output, inputs in self.outputs.items()
+            },
+            "shapes": self.shapes,
+            "headers": sorted(self.headers),
+        }
+        with open(OutputManifest.path(), "w") as filehandle:
+            json.dump(data, filehandle, indent=1, sort_keys=True)
+
+    def changed_inputs(self, input_digests):
+        filepaths = set(input_digests) | set(self.inputs)
+        return set(
+            filepath
+            for filepath in filepaths
+            if input_digests.get(filepath, None) != self.inputs.get(filepath, None)
+        )
 
+
+def remove_generated_proto(relpath):
+    stem = os.path.splitext(relpath)[0]
+    for filepath in [
+        os.path.join(GRPC_DIR, relpath),
+        os.path.join(PROTO_OUT_DIR, stem + ".pb.h"),
+        os.path.join(PROTO_OUT_DIR, stem + ".pb.cc"),
+        os.path.join(PROTO_OUT_DIR, stem + ".grpc.pb.h"),
+        os.path.join(PROTO_OUT_DIR, stem + ".grpc.pb.cc"),
+    ]:
+        if os.path.exists(filepath):
+            print("Removing stale {}".format(filepath))
+            os.remove(filepath)
+        # drop directories that no longer hold any output
+        dirname = os.path.dirname(filepath)
+        if dirname not in [GRPC_DIR, PROTO_OUT_DIR] and os.path.isdir(dirname):
+            if len(os.listdir(dirname)) == 0:
+                os.rmdir(dirname)
+
+
+def write_protos(flat_list, input_digests, manifest, new_manifest, jobs=1):
+    # manifest is the previous run's, or None
+    new_manifest.inputs = input_digests
+
+    # None means everything needs to be regenerated
+    changed_inputs = None
+    if not incremental:
+        manifest = None
+    if manifest is not None and manifest.generator == generator_version():
+        changed_inputs = manifest.changed_inputs(input_digests)
+        print("{} schema files changed".format(len(changed_inputs)))
+
+    if changed_inputs is None:
         clear_and_make_output_dirs()
+    else:
+        os.makedirs(PROTO_OUT_DIR, exist_ok=True)
+
+    # When several types map to the same proto, the last one wins, so only it
+    # is emitted
+    last_index = {}
+    for index, thistype in enumerate(flat_list):
+        relpath = get_grpc_filename_from_entity(thistype)
+        dependencies = get_proto_dependencies(thistype)
+        new_manifest.outputs.setdefault(relpath, set()).update(dependencies)
+        last_index[relpath] = index
+
+    to_emit = {}
+    for relpath, index in last_index.items():
+        new_manifest.shapes[relpath] = get_proto_shape(flat_list[index])
+        if (
+            changed_inputs is not None
+            and relpath in manifest.outputs
+            and new_manifest.outputs[relpath].isdisjoint(changed_inputs)
+            and manifest.shapes.get(relpath, None) == new_manifest.shapes[relpath]
+            and os.path.exists(os.path.join(GRPC_DIR, relpath))
+        ):
+            continue
+        to_emit[relpath] = index
+
+    # Emitted a level of the type graph at a time, so that a proto is written
+    # after the protos of the types it nests
+    level = {}
+    for depth, nodes in enumerate(TypeGraph(flat_list).levels()):
+        for node in nodes:
+            level[node] = depth
+    batches = OrderedDict()
+    for index in sorted(to_emit.values(), key=lambda x: (level[flat_list[x]], x)):
+        batches.setdefault(level[flat_list[index]], []).append(index)
+    results = emit_grpc_for_types(flat_list, list(batches.values()), jobs)
+    for index in to_emit.values():
+        counters["emitted_" + type(flat_list[index]).__name__] += 1
+    regenerated = len([changed for _filepath, changed in results if changed])
+
+    for thistype in flat_list:
+        relpath = get_grpc_filename_from_entity(thistype)
+        write_meson_file_for_proto(os.path.join(GRPC_DIR, relpath))
+
+    if changed_inputs is not None:
+        print("Regenerated {} protos".format(regenerated))
+        for relpath in sorted(set(manifest.outputs) - set(new_manifest.outputs)):
+            remove_generated_proto(relpath)
+
+
+def proto_needs_compile(proto_path):
+    relpath = os.path.relpath(proto_path, GRPC_DIR)
+    output = os.path.join(PROTO_OUT_DIR, os.path.splitext(relpath)[0] + ".pb.cc")
+    if not os.path.exists(output):
+        return True
+    return os.path.getmtime(output) < os.path.getmtime(proto_path)
+
+
+def get_proto_filepaths():
+    proto_files = []
+    for root, dirs, files in os.walk(GRPC_DIR):
+        for filepath in files:
+            if filepath.endswith(".proto"):
+                proto_files.append(os.path.join(root, filepath))
+    proto_files.sort()
+    return proto_files
+
+
+def run_protoc_batch(batch):
+    args = ["protoc", "--cpp_out", "proto_out", "-I", GRPC_DIR] + batch
+    start = time.monotonic()
+    subprocess.check_output(args, cwd=GRPC_DIR)
+    return time.monotonic() - start
+
+
+def run_protoc(proto_files, jobs, batch_size):
+    # Each protoc invocation compiles a whole batch, so shared imports are
+    # only parsed once per batch, and batches run in parallel.  Every proto
+    # produces its own outputs, so the result doesn't depend on how they were
+    # batched.
+    batches = [
+        proto_files[index : index + batch_size]
+        for index in range(0, len(proto_files), batch_size)
+    ]
+    print(
+        "Compiling {} protos in {} batches with {} jobs".format(
+            len(proto_files), len(batches), jobs
+        )
+    )
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        durations = executor.map(run_protoc_batch, batches)
+        for index, (batch, duration) in enumerate(zip(batches, durations)):
+            print(
+                "protoc batch {}/{}: {} protos in {:.2f}s".format(
+                    index + 1, len(batches), len(batch), duration
+                )
+            )
+    print("protoc finished in {:.2f}s".format(time.monotonic() - start))
+
+
+# Wall time, CPU time and peak RSS of every phase of the run, in the order
+# they ran
+phase_stats = []
+
+# Trace Python allocations in every phase, recording the traced peak and the
+# sites that grew the most
+trace_memory = False
+trace_memory_sites = 10
+
+# RSS, in KB, that a phase and its child processes may not go over.  None
+# disables the check.
+memory_budget_kb = None
+
+# How often, in seconds, a running phase's RSS is checked against the budget
+memory_poll_interval = 0.05
+
+# Set by the memory watcher to the message for the phase it stopped
+memory_overrun = None
+
+
+class MemoryBudgetExceeded(Exception):
+    pass
+
+
+def reset_peak_rss():
+    # Resets VmHWM so that it only covers the phase about to start
+    try:
+        with open("/proc/self/clear_refs", "w") as filehandle:
+            filehandle.write("5")
+    except OSError:
+        pass
+
+
+def read_peak_rss_kb():
+    try:
+        with open("/proc/self/status") as filehandle:
+            for line in filehandle:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # Without procfs this is the peak of the whole process so far
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def read_rss_kb(pid="self"):
+    try:
+        with open("/proc/{}/status".format(pid)) as filehandle:
+            for line in filehandle:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def get_child_pids():
+    # Pool workers and protoc, while they are still running
+    pids = []
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return pids
+    parent = str(os.getpid())
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open("/proc/{}/stat".format(entry)) as filehandle:
+                stat = filehandle.read()
+        except OSError:
+            continue
+        # The command name can contain spaces, so split after it
+        if stat.rsplit(")", 1)[-1].split()[1] == parent:
+            pids.append(entry)
+    return pids
+
+
+def read_memory_in_use_kb():
+    return read_rss_kb() + sum(read_rss_kb(pid) for pid in get_child_pids())
 
-        for thistype in flat_list:
-            # print("{}.{}".format(thistype.name, thistype.namespace))
-            generate_grpc_for_type(thistype)
 
-        write_fixed_messages()
+def watch_memory_budget(name, stopped):
+    global memory_overrun
+    while not stopped.wait(memory_poll_interval):
+        in_use = read_memory_in_use_kb()
+        if in_use > memory_budget_kb:
+            memory_overrun = (
+                "Phase {} was using {} KB with its child processes, "
+                "over the {} KB memory budget".format(name, in_use, memory_budget_kb)
+            )
+            # A real signal, so that the main thread wakes up even when it
+            # is blocked waiting on the pool
+            signal.pthread_kill(threading.main_thread().ident, signal.SIGINT)
+            return
+
+
+def take_memory_snapshot():
+    return tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(False, tracemalloc.__file__)]
+    )
 
-        write_service_root(flat_list)
-        write_cpp_code(flat_list)
+
+def get_allocation_growth(snapshot_start):
+    growth = take_memory_snapshot().compare_to(snapshot_start, "lineno")
+    return [
+        {
+            "site": str(statistic.traceback),
+            "size_kb": statistic.size_diff // 1024,
+            "count": statistic.count_diff,
+        }
+        for statistic in growth[:trace_memory_sites]
+    ]
+
+
+def print_memory_report(stats):
+    print(
+        "Phase {}: peak rss {} KB, traced peak {} KB".format(
+            stats["phase"], stats["peak_rss_kb"], stats["traced_peak_kb"]
+        )
+    )
+    for allocation in stats["top_allocations"]:
+        print(
+            "    {:>+10} KB {:>+9} blocks  {}".format(
+                allocation["size_kb"], allocation["count"], allocation["site"]
+            )
+        )
+
+
+def check_memory_budget(stats, children_start):
+    # The watcher samples, so a short spike can fall between two polls; the
+    # high water marks catch those once the phase is over.  The children's
+    # mark covers the whole run, so it only counts against this phase when a
+    # child that exited during it raised the mark.
+    peak = stats["peak_rss_kb"]
+    if stats["children_peak_rss_kb_cumulative"] > children_start.ru_maxrss:
+        peak = max(peak, stats["children_peak_rss_kb_cumulative"])
+    if memory_budget_kb is not None and peak > memory_budget_kb:
+        raise MemoryBudgetExceeded(
+            "Phase {} peaked at {} KB, over the {} KB memory budget".format(
+                stats["phase"], peak, memory_budget_kb
+            )
+        )
+
+
+@contextlib.contextmanager
+def phase(name):
+    if trace_memory:
+        snapshot_start = take_memory_snapshot()
+        tracemalloc.reset_peak()
+    reset_peak_rss()
+    children_start = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    watcher = None
+    if memory_budget_kb is not None:
+        stopped = threading.Event()
+        watcher = threading.Thread(
+            target=watch_memory_budget, args=(name, stopped), daemon=True
+        )
+        watcher.start()
+    try:
+        yield
+    except KeyboardInterrupt:
+        if memory_overrun is None:
+            raise
+        raise MemoryBudgetExceeded(memory_overrun) from None
+    finally:
+        if watcher is not None:
+            stopped.set()
+            watcher.join()
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    stats = {
+        "phase": name,
+        "wall_s": wall,
+        "cpu_s": cpu,
+        # Pool workers and protoc, once they have exited
+        "children_cpu_s": children.ru_utime
+        + children.ru_stime
+        - children_start.ru_utime
+        - children_start.ru_stime,
+        "peak_rss_kb": read_peak_rss_kb(),
+        # The largest peak of any child that has exited so far in the run,
+        # not only in this phase
+        "children_peak_rss_kb_cumulative": children.ru_maxrss,
+    }
+    if trace_memory:
+        stats["traced_peak_kb"] = tracemalloc.get_traced_memory()[1] // 1024
+        stats["top_allocations"] = get_allocation_growth(snapshot_start)
+        print_memory_report(stats)
+    phase_stats.append(stats)
+    check_memory_budget(stats, children_start)
+
+
+def get_run_summary():
+    summary = {
+        "phases": phase_stats,
+        "counters": {},
+        "types_emitted": {},
+        "resolution_cache": {
+            "hits": resolution_cache.hits,
+            "misses": resolution_cache.misses,
+        },
+    }
+    # Counters that never fired are still reported, as zero
+    for key in sorted(set(counters) | set(reported_counters)):
+        if key.startswith("xml_cache_") and xml_backend not in xml_cache_backends:
+            continue
+        if key.startswith("emitted_"):
+            summary["types_emitted"][key[len("emitted_") :]] = counters[key]
+        else:
+            summary["counters"][key] = counters[key]
+    return summary
+
+
+def print_run_summary(summary):
+    for stats in summary["phases"]:
+        print(
+            "{:<16} wall {:8.3f}s  cpu {:8.3f}s  peak rss {} KB".format(
+                stats["phase"],
+                stats["wall_s"],
+                stats["cpu_s"] + stats["children_cpu_s"],
+                stats["peak_rss_kb"],
+            )
+        )
+    for key, count in summary["counters"].items():
+        print("{}: {}".format(key, count))
+    for kind, count in summary["types_emitted"].items():
+        print("{} emitted: {}".format(kind, count))
+
+
+def write_json_file(filepath, data):
+    with open(filepath, "w") as filehandle:
+        json.dump(data, filehandle, indent=1)
+
+
+def get_profile_hotspots(profiler, count=30):
+    # The functions with the most cumulative time, for the JSON summary; the
+    # pstats dump has the rest
+    stats = pstats.Stats(profiler).stats
+    hotspots = sorted(stats.items(), key=lambda x: x[1][3], reverse=True)[:count]
+    return [
+        {
+            "function": pstats.func_std_string(function),
+            "calls": calls,
+            "total_s": total,
+            "cumulative_s": cumulative,
+        }
+        for function, (_primitive, calls, total, cumulative, _callers) in hotspots
+    ]
+
+
+def get_path_depth(value):
+    depth = int(value)
+    if depth < 0:
+        raise argparse.ArgumentTypeError(
+            "{} isn't a depth, it can't be negative".format(value)
+        )
+    return depth
+
+
+def get_xml_cache_size(value):
+    size = int(value)
+    if size < 1:
+        raise argparse.ArgumentTypeError("{} isn't at least 1".format(value))
+    return size
+
+
+def main():
+    global incremental
+    global path_rpcs
+    global stream_collections
+    global max_path_depth
+    global trace_memory
+    global memory_budget_kb
+    global xml_backend
+    global xml_cache_size
+    global REDFISH_SCHEMA_DIR
+    global GRPC_DIR
+    global PROTO_OUT_DIR
+    global CPP_OUT_DIR
+    global PARSE_CACHE_DIR
+    global start_method
+    global allow_missing_schemas
+
+    parser = argparse.ArgumentParser(
+        description="Generate grpc definitions from Redfish CSDL schemas"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only regenerate outputs whose schema inputs have changed",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=cpu_count(),
+        help="number of emission workers and protoc invocations to run at once",
+    )
+    parser.add_argument(
+        "--start-method",
+        choices=multiprocessing.get_all_start_methods(),
+        help="how to start parse and emission workers; defaults to the "
+        "platform's own",
+    )
+    parser.add_argument(
+        "--protoc-batch-size",
+        type=int,
+        default=64,
+        help="number of protos to pass to each protoc invocation",
+    )
+    parser.add_argument(
+        "--schema-mirror",
+        help="directory or base URL to fetch missing schemas from before "
+        "trying their reference URI",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="never fetch missing schemas from their reference URI",
+    )
+    parser.add_argument(
+        "--allow-missing-schemas",
+        action="store_true",
+        help="carry on when a referenced schema can't be found, leaving out "
+        "whatever depends on it",
+    )
+    parser.add_argument(
+        "--download-jobs",
+        type=int,
+        default=8,
+        help="number of missing schemas to fetch at once",
+    )
+    parser.add_argument(
+        "--xml-backend",
+        choices=sorted(xml_backends),
+        default=xml_backend,
+        help="how schema files are read; every backend produces the same types",
+    )
+    parser.add_argument(
+        "--xml-cache-size",
+        type=get_xml_cache_size,
+        default=xml_cache_size,
+        metavar="TREES",
+        help="most parsed XML trees the etree backend keeps at once",
+    )
+    parser.add_argument(
+        "--root",
+        action="append",
+        default=[],
+        help="type to generate protos for, along with everything it reaches, "
+        "in addition to ServiceRoot; may be given more than once",
+    )
+    parser.add_argument(
+        "--path-rpcs",
+        action="store_true",
+        help="also generate an RPC for every navigation path from ServiceRoot, "
+        "on top of the one RPC per resource type",
+    )
+    parser.add_argument(
+        "--stream-collections",
+        action="store_true",
+        help="also generate a server-streaming RPC for every collection, such "
+        "as StreamLogEntryCollection, that sends its members as they're fetched",
+    )
+    parser.add_argument(
+        "--max-path-depth",
+        type=get_path_depth,
+        help="with --path-rpcs, follow at most this many navigation properties "
+        "below ServiceRoot",
+    )
+    parser.add_argument(
+        "--all-types",
+        action="store_true",
+        help="generate protos for every type, even those unreachable from the " "roots",
+    )
+    parser.add_argument(
+        "--schema-dir",
+        default=REDFISH_SCHEMA_DIR,
+        help="directory of CSDL schemas to generate from",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=GRPC_DIR,
+        help="directory to write the protos to",
+    )
+    parser.add_argument(
+        "--cpp-output-dir",
+        default=CPP_OUT_DIR,
+        help="directory to write grpc_defs.hpp to",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="neither read nor write the parse cache",
+    )
+    parser.add_argument(
+        "--no-protoc",
+        action="store_true",
+        help="only generate the protos, without compiling them",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="profile",
+        metavar="PREFIX",
+        help="profile the run, printing per phase timings and counters, and "
+        "writing PREFIX.pstats and a PREFIX.json summary (default: profile); "
+        "work done in pool workers is only counted, not profiled",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="trace Python allocations in every phase and report the traced "
+        "peak and the allocation sites left holding the most new memory; this "
+        "makes the run several times slower",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        metavar="MB",
+        help="stop when the RSS of a phase and its child processes goes over this "
+        "many MB; RSS is polled every {}s while a phase runs, and each "
+        "phase's peak is checked when it ends".format(memory_poll_interval),
+    )
+    parser.add_argument(
+        "--phase-stats",
+        help="write the wall time, CPU time and peak RSS of every phase to "
+        "this JSON file",
+    )
+    args = parser.parse_args()
+    incremental = args.incremental
+    path_rpcs = args.path_rpcs
+    stream_collections = args.stream_collections
+    max_path_depth = args.max_path_depth
+    xml_backend = args.xml_backend
+    xml_cache_size = args.xml_cache_size
+    REDFISH_SCHEMA_DIR = args.schema_dir
+    GRPC_DIR = os.path.abspath(args.output_dir)
+    PROTO_OUT_DIR = os.path.join(GRPC_DIR, "proto_out")
+    CPP_OUT_DIR = args.cpp_output_dir
+    start_method = args.start_method
+    allow_missing_schemas = args.allow_missing_schemas
+    if args.no_cache:
+        PARSE_CACHE_DIR = None
+    trace_memory = args.trace_memory
+    if args.memory_budget is not None:
+        memory_budget_kb = args.memory_budget * 1024
+
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        run(args)
+    except (MemoryBudgetExceeded, KeyboardInterrupt) as error:
+        # The watcher's signal can land just after its phase has ended
+        if isinstance(error, KeyboardInterrupt) and memory_overrun is None:
+            raise
+        print(memory_overrun if memory_overrun is not None else error)
+        sys.exit(1)
+
+
+def run(args):
+    if args.profile is None:
+        generate(args)
+    else:
+        profiler = cProfile.Profile()
+        profiler.runcall(generate, args)
+        profiler.dump_stats(args.profile + ".pstats")
+        summary = get_run_summary()
+        summary["hotspots"] = get_profile_hotspots(profiler)
+        write_json_file(args.profile + ".json", summary)
+        print_run_summary(summary)
+        print("Wrote {0}.pstats and {0}.json".format(args.profile))
+
+    if args.phase_stats is not None:
+        write_json_file(args.phase_stats, get_run_summary())
+
+
+def generate(args):
+    gen_protos = True
+    gen_cpp = not args.no_protoc
+    parse_jobs = args.jobs if multithread else 1
+    if gen_protos:
+        with phase("parse"):
+            build_symbol_index(REDFISH_SCHEMA_DIR, parse_jobs)
+        with phase("prefetch"):
+            prefetch_schemas(
+                args.schema_mirror,
+                args.offline,
+                args.download_jobs,
+                allow_missing_schemas,
+            )
+            input_digests = get_input_digests(get_schema_filepaths())
+        root_names = None if args.all_types else ["ServiceRoot"] + args.root
+        flat_list = load_type_graph(input_digests, parse_jobs, root_names)
+        manifest = OutputManifest.load()
+        new_manifest = OutputManifest(generator_version())
+
+        with phase("protos"):
+            write_protos(flat_list, input_digests, manifest, new_manifest, args.jobs)
+
+            write_fixed_messages()
+
+        with phase("service_root"):
+            write_service_root(flat_list)
+        with phase("cpp"):
+            write_cpp_code(flat_list, manifest, new_manifest)
+        with phase("routes"):
+            write_route_table(flat_list)
         write_meson_root_config()
+        new_manifest.save()
 
     if gen_cpp:
-        for root, dirs, files in os.walk(GRPC_DIR):
-            files.sort()
-            for filepath in files:
-                if not filepath.endswith(".proto"):
-                    continue
-                args = [
-                    "protoc",
-                    "--cpp_out",
-                    "proto_out",
-                    "-I",
-                    GRPC_DIR,
-                    os.path.join(root, filepath),
-                ]
-                print(" ".join(args))
-                subprocess.check_output(args, cwd=GRPC_DIR)
+        with phase("protoc"):
+            proto_files = get_proto_filepaths()
+            if incremental:
+                proto_files = [x for x in proto_files if proto_needs_compile(x)]
+            run_protoc(proto_files, args.jobs, args.protoc_batch_size)
 
 
 if __name__ == "__main__":